@@ -8,17 +8,57 @@ This module handles:
 dnsmasq is configured with `hostsdir` pointing at the directory containing
 the hosts file, so it reloads automatically via inotify when the file changes.
 No SIGHUP or sudo is required.
+
+The blocklist is split into two shards in that directory: always-blocked
+domains live in a sibling `<blocked_hosts>.always` file written once at
+startup, and only the (small) conditional shard is rewritten on unblock/reblock.
 """
 
 import asyncio
+import bisect
+import heapq
+import itertools
 import logging
+import time
+from collections import defaultdict
+from contextlib import suppress
 from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Optional, Callable, Awaitable
+from typing import Optional, Callable, Awaitable, Iterable
 
 logger = logging.getLogger(__name__)
 
 HOSTS_HEADER = "# Managed by Productivity Guard — do not edit manually\n"
+ALWAYS_BLOCKED_SUFFIX = ".always"
+
+# Window in which bursts of unblock/reblock calls are coalesced into one write
+FLUSH_DELAY_SECONDS = 0.02
+
+
+def render_hosts(sorted_domains: list[str]) -> str:
+    """Render a hosts file mapping each domain to 0.0.0.0, in the given order.
+
+    Callers pass domains already sorted, so identical sets render to identical
+    files.
+    """
+    return HOSTS_HEADER + "".join(f"0.0.0.0 {domain}\n" for domain in sorted_domains)
+
+
+def www_variant(domain: str) -> str:
+    """Return the www/non-www counterpart of a domain."""
+    return domain[4:] if domain.startswith("www.") else f"www.{domain}"
+
+
+def build_related_domains(blocked_domains: set[str]) -> dict[str, frozenset[str]]:
+    """Map every domain to the www/non-www variant of it that is blocked.
+
+    Keys include variants that are not themselves blocked, so e.g. revoking
+    "www.example.com" still finds "example.com" when only the latter is listed.
+    """
+    related: dict[str, set[str]] = {}
+    for domain in blocked_domains:
+        related.setdefault(www_variant(domain), set()).add(domain)
+    return {domain: frozenset(variants) for domain, variants in related.items()}
 
 
 class ActiveUnblock:
@@ -40,7 +80,6 @@ class ActiveUnblock:
         self.reason = reason
         self.unblocked_at = datetime.now()
         self.expires_at = self.unblocked_at + timedelta(minutes=duration_minutes)
-        self.timer_task: Optional[asyncio.Task] = None
 
 
 class BlocklistManager:
@@ -52,14 +91,45 @@ class BlocklistManager:
         on_reblock_callback: Optional[Callable[[str], Awaitable[None]]] = None,
     ):
         self.blocked_hosts_path = Path(blocked_hosts_path)
+        self.always_blocked_path = self.blocked_hosts_path.with_name(
+            self.blocked_hosts_path.name + ALWAYS_BLOCKED_SUFFIX
+        )
         self.conditional_domains = set(conditional_domains)
         self.always_blocked_domains = set(always_blocked_domains)
         self.all_blocked_domains = self.conditional_domains | self.always_blocked_domains
+        # Domain lists are fixed after init, so www/non-www pairs are computed once
+        self._related_domains = build_related_domains(self.all_blocked_domains)
+        # Always-blocked domains never change at runtime — render their shard once
+        self._always_blocked_content = render_hosts(sorted(self.always_blocked_domains))
         self.active_unblocks: dict[str, ActiveUnblock] = {}  # domain -> ActiveUnblock
+        # Secondary index of active_unblocks: device_ip -> domains unblocked for it.
+        # Kept in step by _track_unblock/_untrack_unblock; never mutate directly.
+        self.active_by_device: defaultdict[str, set[str]] = defaultdict(set)
+        # Bumped on every change to active_unblocks, so callers can cache views of it
+        self.revision = 0
         self.on_reblock_callback = on_reblock_callback
+        self._pending_flush: Optional[asyncio.Task] = None
+        # Serializes shard writes so an older render can never land last
+        self._write_lock = asyncio.Lock()
+        # Conditional domains that may be lifted from the blocklist (always-blocked
+        # ones never leave it, even when listed as a www variant of an unblock)
+        self._unblockable_domains = self.conditional_domains - self.always_blocked_domains
+        # Current contents of the conditional shard as a sorted list, maintained
+        # incrementally (bisect) on unblock/reblock so writes never re-sort;
+        # _blocklist_dirty marks it as not yet written
+        self._blocked_conditional = sorted(self._unblockable_domains)
+        self._blocklist_dirty = True
+        # Re-block schedule: (monotonic deadline, tiebreaker, unblock, domains).
+        # Entries are never removed early — an entry whose unblock is no longer
+        # the active one (re-blocked or extended) is simply skipped when popped.
+        self._reblock_heap: list[tuple[float, int, ActiveUnblock, frozenset[str]]] = []
+        self._reblock_sequence = itertools.count()
+        self._reblock_wake: Optional[asyncio.Event] = None
+        self._scheduler: Optional[asyncio.Task] = None
 
     async def initialize(self):
-        """Write the full blocklist. Called on startup."""
+        """Write both blocklist shards. Called on startup."""
+        await self._write_hosts_file(self.always_blocked_path, self._always_blocked_content)
         await self._write_blocklist()
         logger.info(
             "Blocklist initialized with %d domains", len(self.all_blocked_domains)
@@ -83,11 +153,9 @@ class BlocklistManager:
             logger.warning("Attempted to unblock unknown domain: %s", domain)
             return False
 
-        # If already unblocked, cancel the existing timer and extend
+        # If already unblocked, extend — the old schedule entry goes stale
         if domain in self.active_unblocks:
             existing = self.active_unblocks[domain]
-            if existing.timer_task:
-                existing.timer_task.cancel()
             logger.info("Extending unblock for %s (was for %s)", domain, existing.device_ip)
 
         # Also unblock www variant if the base domain was requested, and vice versa
@@ -105,15 +173,14 @@ class BlocklistManager:
 
         # Track all related domains under the same unblock
         for d in domains_to_unblock:
-            self.active_unblocks[d] = unblock
+            self._track_unblock(d, unblock)
+        self._lift_from_blocklist(domains_to_unblock)
 
         # Rewrite the blocklist without the unblocked domains
-        await self._write_blocklist()
+        await self._flush_blocklist()
 
         # Schedule re-block
-        unblock.timer_task = asyncio.create_task(
-            self._reblock_after(domains_to_unblock, duration_minutes)
-        )
+        self._schedule_reblock(unblock, frozenset(domains_to_unblock), duration_minutes)
 
         logger.info(
             "Unblocked %s for %s (%s) — %d minutes, scope: %s",
@@ -123,25 +190,32 @@ class BlocklistManager:
 
     async def reblock_domain(self, domain: str):
         """Immediately re-block a domain."""
-        related_domains = self._get_related_domains(domain)
-        domains_to_reblock = {domain} | related_domains
-
-        for d in list(domains_to_reblock):
-            if d in self.active_unblocks:
-                unblock = self.active_unblocks.pop(d)
-                if unblock.timer_task:
-                    unblock.timer_task.cancel()
-
-        await self._write_blocklist()
+        await self.reblock_domains([domain])
+
+    async def reblock_domains(self, domains: Iterable[str]):
+        """Immediately re-block several domains with a single blocklist write."""
+        domains_to_reblock: set[str] = set()
+        for domain in domains:
+            domains_to_reblock.add(domain)
+            domains_to_reblock |= self._get_related_domains(domain)
+        if not domains_to_reblock:
+            return
+
+        for d in domains_to_reblock:
+            self._untrack_unblock(d)
+        self._return_to_blocklist(domains_to_reblock)
+
+        await self._flush_blocklist()
         logger.info("Re-blocked domains: %s", domains_to_reblock)
 
     async def reblock_all(self):
-        """Re-block all domains. Cancel all timers."""
-        for domain, unblock in self.active_unblocks.items():
-            if unblock.timer_task:
-                unblock.timer_task.cancel()
+        """Re-block all domains and clear the re-block schedule."""
+        self._return_to_blocklist(self.active_unblocks.keys())
         self.active_unblocks.clear()
-        await self._write_blocklist()
+        self.active_by_device.clear()
+        self.revision += 1
+        self._reblock_heap.clear()
+        await self._flush_blocklist()
         logger.info("Re-blocked all domains")
 
     def get_active_unblocks(self) -> list[ActiveUnblock]:
@@ -157,51 +231,160 @@ class BlocklistManager:
     def is_domain_unblocked(self, domain: str) -> bool:
         return domain in self.active_unblocks
 
-    def _get_related_domains(self, domain: str) -> set[str]:
+    async def close(self):
+        """Stop the re-block scheduler. Called on shutdown."""
+        if self._scheduler:
+            self._scheduler.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._scheduler
+            self._scheduler = None
+
+    def _track_unblock(self, domain: str, unblock: ActiveUnblock):
+        """Record an active unblock, moving the domain off any previous device."""
+        previous = self.active_unblocks.get(domain)
+        if previous is not None:
+            self._discard_device_domain(previous.device_ip, domain)
+        self.active_unblocks[domain] = unblock
+        self.active_by_device[unblock.device_ip].add(domain)
+        self.revision += 1
+
+    def _untrack_unblock(self, domain: str):
+        """Forget the active unblock for a domain, if any."""
+        unblock = self.active_unblocks.pop(domain, None)
+        if unblock is not None:
+            self._discard_device_domain(unblock.device_ip, domain)
+            self.revision += 1
+
+    def _discard_device_domain(self, device_ip: str, domain: str):
+        device_domains = self.active_by_device.get(device_ip)
+        if device_domains is None:
+            return
+        device_domains.discard(domain)
+        if not device_domains:
+            del self.active_by_device[device_ip]
+
+    def _get_related_domains(self, domain: str) -> frozenset[str]:
         """Get www/non-www variants that are also in our domain lists."""
-        related = set()
-        if domain.startswith("www."):
-            base = domain[4:]
-            if base in self.all_blocked_domains:
-                related.add(base)
-        else:
-            www = f"www.{domain}"
-            if www in self.all_blocked_domains:
-                related.add(www)
-        return related
+        return self._related_domains.get(domain, frozenset())
 
-    async def _write_blocklist(self):
-        """Write the blocked_hosts file with all domains EXCEPT currently unblocked ones.
+    async def _flush_blocklist(self):
+        """Write the blocklist, coalescing concurrent callers into one write.
+
+        Callers arriving within FLUSH_DELAY_SECONDS of each other share a single
+        pending write; each returns once that write has completed. The write is
+        shielded so a cancelled caller (e.g. a dropped request) cannot abort it.
+        """
+        if self._pending_flush is None:
+            self._pending_flush = asyncio.create_task(self._flush_after_delay())
+        await asyncio.shield(self._pending_flush)
+
+    async def _flush_after_delay(self):
+        await asyncio.sleep(FLUSH_DELAY_SECONDS)
+        # Clear before writing so changes made during the write schedule a new flush
+        self._pending_flush = None
+        await self._write_blocklist()
 
+    async def _write_blocklist(self):
+        """Write the conditional shard with all conditional domains EXCEPT
+        currently unblocked ones.
+
+        Always-blocked domains never change at runtime, so they live in their
+        own shard written once by `initialize` and are skipped here. The write
+        is skipped entirely when the blocked set has not changed since the last
+        successful write. Writes run one at a time under `_write_lock`, and each
+        renders after the previous one finishes, so the newest state lands last.
         dnsmasq watches the directory with inotify (hostsdir) and picks up the
         change automatically — no SIGHUP needed.
         """
-        unblocked = set(self.active_unblocks.keys())
-        blocked = self.all_blocked_domains - unblocked
-
-        lines = [HOSTS_HEADER]
-        lines.append(f"# Updated: {datetime.now().isoformat()}\n")
-        for domain in sorted(blocked):
-            lines.append(f"0.0.0.0 {domain}\n")
-
-        content = "".join(lines)
-
+        async with self._write_lock:
+            if not self._blocklist_dirty:
+                return
+            # Clear before the write so changes made while it runs mark it dirty again
+            self._blocklist_dirty = False
+            content = render_hosts(self._blocked_conditional)
+            if not await self._write_hosts_file(self.blocked_hosts_path, content):
+                self._blocklist_dirty = True
+
+    def _lift_from_blocklist(self, domains: Iterable[str]):
+        """Remove unblocked domains from the conditional shard contents."""
+        for domain in domains:
+            i = bisect.bisect_left(self._blocked_conditional, domain)
+            if i < len(self._blocked_conditional) and self._blocked_conditional[i] == domain:
+                del self._blocked_conditional[i]
+                self._blocklist_dirty = True
+
+    def _return_to_blocklist(self, domains: Iterable[str]):
+        """Add re-blocked domains back to the conditional shard contents."""
+        for domain in domains:
+            if domain not in self._unblockable_domains:
+                continue
+            i = bisect.bisect_left(self._blocked_conditional, domain)
+            if i == len(self._blocked_conditional) or self._blocked_conditional[i] != domain:
+                self._blocked_conditional.insert(i, domain)
+                self._blocklist_dirty = True
+
+    async def _write_hosts_file(self, path: Path, content: str) -> bool:
+        """Write a hosts file. Returns True if successful.
+
+        The blocking file write runs in a worker thread so it never stalls the
+        event loop (HA queries, Claude calls, SQLite) while the disk is busy.
+        """
         try:
-            self.blocked_hosts_path.write_text(content)
+            await asyncio.to_thread(path.write_text, content)
         except OSError as e:
-            logger.error("Failed to write blocklist: %s", e)
+            logger.error("Failed to write blocklist %s: %s", path, e)
+            return False
+        return True
 
-    async def _reblock_after(self, domains: set[str], minutes: int):
-        """Wait for the duration, then re-block the domains."""
-        try:
-            await asyncio.sleep(minutes * 60)
-            for d in domains:
-                self.active_unblocks.pop(d, None)
-            await self._write_blocklist()
-            logger.info("Auto re-blocked after %d minutes: %s", minutes, domains)
-            if self.on_reblock_callback:
-                for d in domains:
-                    await self.on_reblock_callback(d)
-        except asyncio.CancelledError:
-            # Timer was cancelled (domain was manually re-blocked or extended)
-            pass
+    def _schedule_reblock(
+        self, unblock: ActiveUnblock, domains: frozenset[str], minutes: int
+    ):
+        """Queue domains for re-blocking after `minutes`, starting the scheduler if needed."""
+        deadline = time.monotonic() + minutes * 60
+        heapq.heappush(
+            self._reblock_heap, (deadline, next(self._reblock_sequence), unblock, domains)
+        )
+        if self._scheduler is None or self._scheduler.done():
+            self._reblock_wake = asyncio.Event()
+            self._scheduler = asyncio.create_task(self._run_scheduler())
+        self._reblock_wake.set()
+
+    async def _run_scheduler(self):
+        """Single task that re-blocks domains as their deadlines pass.
+
+        Sleeps until the earliest deadline, or until a new entry is pushed.
+        """
+        while True:
+            timeout = None
+            if self._reblock_heap:
+                timeout = self._reblock_heap[0][0] - time.monotonic()
+            if timeout is None or timeout > 0:
+                self._reblock_wake.clear()
+                # asyncio.timeout rather than wait_for: on 3.11, wait_for can
+                # swallow a cancel that races with the wake-up, hanging close()
+                with suppress(TimeoutError):
+                    async with asyncio.timeout(timeout):
+                        await self._reblock_wake.wait()
+                continue
+
+            _, _, unblock, domains = heapq.heappop(self._reblock_heap)
+            try:
+                await self._expire_unblock(unblock, domains)
+            except Exception:
+                # Keep the scheduler alive for the remaining unblocks
+                logger.exception("Auto re-block failed for %s", domains)
+
+    async def _expire_unblock(self, unblock: ActiveUnblock, domains: frozenset[str]):
+        """Re-block the domains still held by this unblock."""
+        expired = {d for d in domains if self.active_unblocks.get(d) is unblock}
+        if not expired:
+            # Already re-blocked or extended since this entry was scheduled
+            return
+        for d in expired:
+            self._untrack_unblock(d)
+        self._return_to_blocklist(expired)
+        await self._flush_blocklist()
+        logger.info("Auto re-blocked after expiry: %s", expired)
+        if self.on_reblock_callback:
+            for d in expired:
+                await self.on_reblock_callback(d)
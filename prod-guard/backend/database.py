@@ -1,44 +1,173 @@
 """SQLite database for request history logging."""
 
+import asyncio
+import logging
 import aiosqlite
-from datetime import datetime, date
+from datetime import datetime, date, time, timedelta
 from typing import Optional
 from pathlib import Path
 
+logger = logging.getLogger(__name__)
+
+# Logged requests are queued and written in one transaction this long after
+# the first row arrives, off the request's critical path
+LOG_FLUSH_DELAY_SECONDS = 0.25
+
+# Memory-map up to this much of the database file so reads skip read() copies
+MMAP_SIZE_BYTES = 256 * 1024 * 1024
+
+# Timestamps are stored as INTEGER unix seconds (8 bytes, native compare)
+# and converted back to local ISO strings when rows are read.
+REQUESTS_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS requests (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp INTEGER NOT NULL,
+        device_ip TEXT NOT NULL,
+        device_name TEXT,
+        url TEXT NOT NULL,
+        domain TEXT NOT NULL,
+        reason TEXT NOT NULL,
+        room TEXT,
+        approved INTEGER NOT NULL,
+        scope TEXT,
+        duration_minutes INTEGER,
+        llm_message TEXT,
+        request_number_today INTEGER
+    )
+"""
+
+
+# Statement text is kept constant so the sqlite3 module's per-connection
+# statement cache (keyed on the SQL string) reuses the compiled statement
+# instead of re-preparing it on every call.
+INSERT_REQUEST_SQL = """
+    INSERT INTO requests
+        (timestamp, device_ip, device_name, url, domain, reason, room,
+         approved, scope, duration_minutes, llm_message, request_number_today)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+COUNT_TODAY_SQL = "SELECT COUNT(*) FROM requests WHERE timestamp >= ? AND timestamp < ?"
+COUNT_TODAY_FOR_DEVICE_SQL = (
+    "SELECT COUNT(*) FROM requests "
+    "WHERE device_ip = ? AND timestamp >= ? AND timestamp < ?"
+)
+RECENT_REQUESTS_SQL = "SELECT * FROM requests ORDER BY id DESC LIMIT ?"
+# Filtered reads order by (timestamp, id) rather than id alone: the index
+# entries are already in that order (rowid is the implicit last column), so
+# SQLite walks the index backwards instead of sorting every matching row.
+RECENT_REQUESTS_FOR_DEVICE_SQL = (
+    "SELECT * FROM requests WHERE device_ip = ? ORDER BY timestamp DESC, id DESC LIMIT ?"
+)
+# A device's recent rows with its today count riding along as a scalar
+# subquery; a device with no rows at all has a today count of zero
+DEVICE_CONTEXT_SQL = """
+    SELECT *, (
+        SELECT COUNT(*) FROM requests
+        WHERE device_ip = ? AND timestamp >= ? AND timestamp < ?
+    ) AS today_count
+    FROM requests WHERE device_ip = ? ORDER BY timestamp DESC, id DESC LIMIT ?
+"""
+TODAY_HISTORY_SQL = (
+    "SELECT * FROM requests WHERE timestamp >= ? AND timestamp < ? "
+    "ORDER BY timestamp DESC, id DESC"
+)
+
+
+def _today_bounds() -> tuple[int, int]:
+    """Return [start of today, start of tomorrow) as local unix timestamps."""
+    today = date.today()
+    start = datetime.combine(today, time.min)
+    end = datetime.combine(today + timedelta(days=1), time.min)
+    return int(start.timestamp()), int(end.timestamp())
+
+
+def _row_to_dict(row: aiosqlite.Row) -> dict:
+    """Convert a row to a dict, rendering the unix timestamp as a local ISO string."""
+    result = dict(row)
+    result["timestamp"] = datetime.fromtimestamp(result["timestamp"]).isoformat()
+    return result
+
 
 class Database:
     def __init__(self, db_path: str):
         self.db_path = db_path
         self._db: Optional[aiosqlite.Connection] = None
+        # Rows passed to log_request that are not yet written
+        self._log_queue: list[tuple] = []
+        self._pending_flush: Optional[asyncio.Task] = None
+        # Serializes flushes so close() waits for a write already in progress
+        self._flush_lock = asyncio.Lock()
+        # Today's request counts keyed by device_ip (None = all devices).
+        # Seeded from SQL on first use each day, then bumped by log_request.
+        self._today_counts: dict[Optional[str], int] = {}
+        self._today_date: Optional[date] = None
 
     async def connect(self):
         Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
         self._db = await aiosqlite.connect(self.db_path)
         self._db.row_factory = aiosqlite.Row
-        await self._db.execute("""
-            CREATE TABLE IF NOT EXISTS requests (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp TEXT NOT NULL,
-                device_ip TEXT NOT NULL,
-                device_name TEXT,
-                url TEXT NOT NULL,
-                domain TEXT NOT NULL,
-                reason TEXT NOT NULL,
-                room TEXT,
-                approved INTEGER NOT NULL,
-                scope TEXT,
-                duration_minutes INTEGER,
-                llm_message TEXT,
-                request_number_today INTEGER
-            )
-        """)
+        # WAL lets /history reads run alongside writes; synchronous=NORMAL only
+        # fsyncs at checkpoints, which is safe in WAL mode
+        await self._db.execute("PRAGMA journal_mode=WAL")
+        await self._db.execute("PRAGMA synchronous=NORMAL")
+        await self._db.execute("PRAGMA temp_store=MEMORY")
+        await self._db.execute(f"PRAGMA mmap_size={MMAP_SIZE_BYTES}")
+        await self._migrate_text_timestamps()
+        await self._db.execute(REQUESTS_SCHEMA)
+        await self._db.execute(
+            "CREATE INDEX IF NOT EXISTS idx_requests_timestamp ON requests(timestamp)"
+        )
+        await self._db.execute(
+            "CREATE INDEX IF NOT EXISTS idx_requests_device_timestamp "
+            "ON requests(device_ip, timestamp)"
+        )
+        await self._db.commit()
+
+    async def _migrate_text_timestamps(self):
+        """Rebuild a pre-existing requests table that stored ISO text timestamps.
+
+        SQLite cannot change a column's type in place (a TEXT column would
+        coerce integers back to text), so the table is renamed, recreated with
+        the INTEGER schema, and the rows copied across. The old rows hold local
+        time, which strftime's 'utc' modifier converts to unix seconds.
+
+        The rebuild runs in one explicit transaction (SQLite DDL is
+        transactional), so a failed copy leaves the original table in place.
+        """
+        cursor = await self._db.execute("PRAGMA table_info(requests)")
+        column_types = {row["name"]: row["type"] for row in await cursor.fetchall()}
+        if column_types.get("timestamp") != "TEXT":
+            return
+        await self._db.execute("BEGIN")
+        try:
+            await self._db.execute("ALTER TABLE requests RENAME TO requests_text_timestamps")
+            await self._db.execute(REQUESTS_SCHEMA)
+            await self._db.execute("""
+                INSERT INTO requests
+                    (id, timestamp, device_ip, device_name, url, domain, reason, room,
+                     approved, scope, duration_minutes, llm_message, request_number_today)
+                SELECT
+                    id, CAST(strftime('%s', timestamp, 'utc') AS INTEGER), device_ip,
+                    device_name, url, domain, reason, room, approved, scope,
+                    duration_minutes, llm_message, request_number_today
+                FROM requests_text_timestamps
+            """)
+            await self._db.execute("DROP TABLE requests_text_timestamps")
+        except Exception:
+            await self._db.rollback()
+            raise
         await self._db.commit()
 
     async def close(self):
+        if self._pending_flush:
+            # Still waiting out the delay; write the queue now instead
+            self._pending_flush.cancel()
+            self._pending_flush = None
+        await self.flush()
         if self._db:
             await self._db.close()
 
-    async def log_request(
+    def log_request(
         self,
         device_ip: str,
         device_name: Optional[str],
@@ -51,16 +180,15 @@ class Database:
         duration_minutes: Optional[int],
         llm_message: Optional[str],
         request_number_today: int,
-    ) -> int:
-        cursor = await self._db.execute(
-            """
-            INSERT INTO requests
-                (timestamp, device_ip, device_name, url, domain, reason, room,
-                 approved, scope, duration_minutes, llm_message, request_number_today)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """,
+    ) -> None:
+        """Queue a request row for writing and return immediately.
+
+        Rows are written in one batch LOG_FLUSH_DELAY_SECONDS after the first
+        queued row; reads flush the queue first so they always see them.
+        """
+        self._log_queue.append(
             (
-                datetime.now().isoformat(),
+                int(datetime.now().timestamp()),
                 device_ip,
                 device_name,
                 url,
@@ -72,45 +200,121 @@ class Database:
                 duration_minutes,
                 llm_message,
                 request_number_today,
-            ),
+            )
         )
-        await self._db.commit()
-        return cursor.lastrowid
+        self._roll_today_counts()
+        for key in (device_ip, None):
+            if key in self._today_counts:
+                self._today_counts[key] += 1
+        if self._pending_flush is None:
+            self._pending_flush = asyncio.create_task(self._flush_after_delay())
+
+    async def _flush_after_delay(self):
+        await asyncio.sleep(LOG_FLUSH_DELAY_SECONDS)
+        # Clear before writing so rows queued meanwhile schedule their own flush
+        self._pending_flush = None
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("Failed to write queued request log rows")
+
+    async def flush(self):
+        """Write all queued request rows in a single transaction."""
+        async with self._flush_lock:
+            await self._flush_locked()
+
+    async def _flush_locked(self):
+        """Write the queued rows; the caller holds _flush_lock."""
+        if not self._log_queue:
+            return
+        rows, self._log_queue = self._log_queue, []
+        try:
+            await self._db.executemany(INSERT_REQUEST_SQL, rows)
+            await self._db.commit()
+        except Exception:
+            # Requeue ahead of rows logged meanwhile so none are lost
+            self._log_queue[:0] = rows
+            await self._db.rollback()
+            raise
+
+    def _queued_count(self, device_ip: Optional[str]) -> int:
+        """Count queued rows for a device (all devices when None)."""
+        if device_ip is None:
+            return len(self._log_queue)
+        return sum(1 for row in self._log_queue if row[1] == device_ip)
+
+    def _roll_today_counts(self):
+        """Drop the cached counts when the local date has changed."""
+        today = date.today()
+        if self._today_date != today:
+            self._today_counts.clear()
+            self._today_date = today
 
     async def get_today_count(self, device_ip: Optional[str] = None) -> int:
-        today_str = date.today().isoformat()
+        self._roll_today_counts()
+        key = device_ip or None
+        if key not in self._today_counts:
+            # Seed under the flush lock: rows logged while the query runs stay
+            # queued (log_request only bumps seeded keys), so fold them in
+            async with self._flush_lock:
+                await self._flush_locked()
+                count = await self._count_today(key)
+                self._today_counts[key] = count + self._queued_count(key)
+        return self._today_counts[key]
+
+    async def _count_today(self, device_ip: Optional[str]) -> int:
+        start, end = _today_bounds()
         if device_ip:
             cursor = await self._db.execute(
-                "SELECT COUNT(*) FROM requests WHERE timestamp LIKE ? AND device_ip = ?",
-                (f"{today_str}%", device_ip),
+                COUNT_TODAY_FOR_DEVICE_SQL, (device_ip, start, end)
             )
         else:
-            cursor = await self._db.execute(
-                "SELECT COUNT(*) FROM requests WHERE timestamp LIKE ?",
-                (f"{today_str}%",),
-            )
+            cursor = await self._db.execute(COUNT_TODAY_SQL, (start, end))
         row = await cursor.fetchone()
         return row[0]
 
     async def get_recent_requests(self, limit: int = 5, device_ip: Optional[str] = None) -> list[dict]:
+        await self.flush()
         if device_ip:
             cursor = await self._db.execute(
-                "SELECT * FROM requests WHERE device_ip = ? ORDER BY id DESC LIMIT ?",
-                (device_ip, limit),
+                RECENT_REQUESTS_FOR_DEVICE_SQL, (device_ip, limit)
             )
         else:
+            cursor = await self._db.execute(RECENT_REQUESTS_SQL, (limit,))
+        rows = await cursor.fetchall()
+        return [_row_to_dict(row) for row in rows]
+
+    async def get_device_context(self, device_ip: str, limit: int = 5) -> tuple[int, list[dict]]:
+        """Return a device's request count today and its most recent requests.
+
+        Costs one query: the recent rows alone when the count is already
+        cached, otherwise a combined query that also seeds the count.
+        """
+        self._roll_today_counts()
+        if device_ip in self._today_counts:
+            recent = await self.get_recent_requests(limit=limit, device_ip=device_ip)
+            return self._today_counts[device_ip], recent
+
+        # Seeded under the flush lock, as in get_today_count
+        async with self._flush_lock:
+            await self._flush_locked()
+            start, end = _today_bounds()
             cursor = await self._db.execute(
-                "SELECT * FROM requests ORDER BY id DESC LIMIT ?",
-                (limit,),
+                DEVICE_CONTEXT_SQL, (device_ip, start, end, device_ip, limit)
             )
-        rows = await cursor.fetchall()
-        return [dict(row) for row in rows]
+            rows = await cursor.fetchall()
+            count = rows[0]["today_count"] if rows else 0
+            count += self._queued_count(device_ip)
+            self._today_counts[device_ip] = count
+        recent = []
+        for row in rows:
+            entry = _row_to_dict(row)
+            del entry["today_count"]
+            recent.append(entry)
+        return count, recent
 
     async def get_today_history(self) -> list[dict]:
-        today_str = date.today().isoformat()
-        cursor = await self._db.execute(
-            "SELECT * FROM requests WHERE timestamp LIKE ? ORDER BY id DESC",
-            (f"{today_str}%",),
-        )
+        await self.flush()
+        cursor = await self._db.execute(TODAY_HISTORY_SQL, _today_bounds())
         rows = await cursor.fetchall()
-        return [dict(row) for row in rows]
+        return [_row_to_dict(row) for row in rows]
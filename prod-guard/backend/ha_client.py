@@ -1,11 +1,26 @@
 """Home Assistant REST API client for querying Bermuda room data and other entities."""
 
+import asyncio
 import logging
+import time
 from typing import Optional
 import httpx
+import orjson
 
 logger = logging.getLogger(__name__)
 
+# Room sensors change on the order of seconds; bursts of access requests
+# within this window share one HA lookup per entity
+STATE_CACHE_TTL_SECONDS = 5.0
+# How often expired entries are swept out of the state cache
+STATE_CACHE_SWEEP_SECONDS = 60.0
+
+# Keep a small pool of idle connections to HA open between requests so
+# lookups skip the TCP handshake
+HTTP_TIMEOUT_SECONDS = 10.0
+HTTP_MAX_CONNECTIONS = 10
+HTTP_KEEPALIVE_EXPIRY_SECONDS = 60.0
+
 
 class HAClient:
     def __init__(self, ha_url: str, token: str, device_map: dict):
@@ -20,6 +35,11 @@ class HAClient:
         self.token = token
         self.device_map = device_map
         self._client: Optional[httpx.AsyncClient] = None
+        # entity_id -> (monotonic fetch time, state)
+        self._state_cache: dict[str, tuple[float, Optional[str]]] = {}
+        self._last_cache_sweep = time.monotonic()
+        # entity_id -> in-flight fetch shared by concurrent callers
+        self._pending_states: dict[str, asyncio.Task] = {}
 
     async def connect(self):
         self._client = httpx.AsyncClient(
@@ -28,7 +48,12 @@ class HAClient:
                 "Authorization": f"Bearer {self.token}",
                 "Content-Type": "application/json",
             },
-            timeout=10.0,
+            timeout=HTTP_TIMEOUT_SECONDS,
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_CONNECTIONS,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY_SECONDS,
+            ),
         )
         # Test connection
         try:
@@ -68,15 +93,51 @@ class HAClient:
         return await self._get_entity_state(entity_id)
 
     async def _get_entity_state(self, entity_id: str) -> Optional[str]:
-        """Query HA REST API for an entity's state value."""
+        """Return an entity's state, cached for STATE_CACHE_TTL_SECONDS.
+
+        Concurrent cache misses for the same entity share a single HTTP request.
+        """
         if not self._client:
             logger.warning("HA client not connected")
             return None
 
+        cached = self._state_cache.get(entity_id)
+        if cached is not None and time.monotonic() - cached[0] < STATE_CACHE_TTL_SECONDS:
+            return cached[1]
+
+        pending = self._pending_states.get(entity_id)
+        if pending is None:
+            pending = asyncio.create_task(self._refresh_entity_state(entity_id))
+            self._pending_states[entity_id] = pending
+        return await asyncio.shield(pending)
+
+    async def _refresh_entity_state(self, entity_id: str) -> Optional[str]:
+        try:
+            state = await self._fetch_entity_state(entity_id)
+        finally:
+            del self._pending_states[entity_id]
+        now = time.monotonic()
+        self._sweep_state_cache(now)
+        self._state_cache[entity_id] = (now, state)
+        return state
+
+    def _sweep_state_cache(self, now: float):
+        """Drop expired entries, at most once per STATE_CACHE_SWEEP_SECONDS."""
+        if now - self._last_cache_sweep < STATE_CACHE_SWEEP_SECONDS:
+            return
+        self._last_cache_sweep = now
+        self._state_cache = {
+            entity_id: entry
+            for entity_id, entry in self._state_cache.items()
+            if now - entry[0] < STATE_CACHE_TTL_SECONDS
+        }
+
+    async def _fetch_entity_state(self, entity_id: str) -> Optional[str]:
+        """Query HA REST API for an entity's state value."""
         try:
             resp = await self._client.get(f"/api/states/{entity_id}")
             if resp.status_code == 200:
-                data = resp.json()
+                data = orjson.loads(resp.content)
                 state = data.get("state")
                 if state and state not in ("unknown", "unavailable"):
                     return state
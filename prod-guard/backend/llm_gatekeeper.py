@@ -1,17 +1,32 @@
 """LLM Gatekeeper — builds context-rich prompts and calls the Claude API for access decisions."""
 
-import json
 import logging
 from datetime import datetime
 from typing import Optional
 from pathlib import Path
 
 import anthropic
+from pydantic import ValidationError
 
 from models import LLMDecision
 
 logger = logging.getLogger(__name__)
 
+# Per-request user message; {history} is empty or a pre-joined
+# "Recent Request History" section
+USER_MESSAGE_TEMPLATE = """\
+## Access Request
+- **URL**: {url}
+- **Reason given**: {reason}
+
+## Context
+- **Time**: {day_name}, {date_str} at {time_str}
+- **Device**: {device_name} ({device_type})
+- **Room**: {room}
+- **Request #{request_number} today**{history}
+
+Evaluate this request and respond with a JSON object."""
+
 
 class LLMGatekeeper:
     def __init__(
@@ -22,7 +37,7 @@ class LLMGatekeeper:
         temperature: float = 0.2,
         system_prompt_path: str = "system_prompt.txt",
     ):
-        self.client = anthropic.Anthropic(api_key=api_key)
+        self.client = anthropic.AsyncAnthropic(api_key=api_key)
         self.model = model
         self.max_tokens = max_tokens
         self.temperature = temperature
@@ -35,6 +50,17 @@ class LLMGatekeeper:
             logger.error("System prompt not found at %s, using fallback", system_prompt_path)
             self.system_prompt = self._fallback_system_prompt()
 
+        # The system prompt is identical on every call, so mark it for
+        # Anthropic prompt caching; repeat calls within the cache lifetime
+        # skip re-processing it
+        self._system_blocks = [
+            {
+                "type": "text",
+                "text": self.system_prompt,
+                "cache_control": {"type": "ephemeral"},
+            }
+        ]
+
     def _fallback_system_prompt(self) -> str:
         return (
             "You are a strict productivity gatekeeper. Default to DENY. "
@@ -54,40 +80,33 @@ class LLMGatekeeper:
     ) -> str:
         """Build the context-rich user message for the Claude API call."""
         now = datetime.now()
-        day_name = now.strftime("%A")
-        time_str = now.strftime("%I:%M %p")
-        date_str = now.strftime("%Y-%m-%d")
-
-        parts = [
-            f"## Access Request",
-            f"- **URL**: {url}",
-            f"- **Reason given**: {reason}",
-            f"",
-            f"## Context",
-            f"- **Time**: {day_name}, {date_str} at {time_str}",
-            f"- **Device**: {device_name or 'unknown'} ({device_type or 'unknown'})",
-            f"- **Room**: {room or 'unknown'}",
-            f"- **Request #{request_count_today + 1} today**",
-        ]
 
+        history = ""
         if recent_requests:
-            parts.append(f"")
-            parts.append(f"## Recent Request History (last {len(recent_requests)})")
-            for req in recent_requests:
-                status = "APPROVED" if req.get("approved") else "DENIED"
-                parts.append(
-                    f"- [{status}] {req.get('url', '?')} — "
+            history = (
+                f"\n\n## Recent Request History (last {len(recent_requests)})\n"
+                + "\n".join(
+                    f"- [{'APPROVED' if req.get('approved') else 'DENIED'}] "
+                    f"{req.get('url', '?')} — "
                     f"reason: \"{req.get('reason', '?')}\" "
                     f"(at {req.get('timestamp', '?')[:16]})"
+                    for req in recent_requests
                 )
+            )
 
-        parts.append(f"")
-        parts.append(
-            "Evaluate this request and respond with a JSON object."
+        return USER_MESSAGE_TEMPLATE.format(
+            url=url,
+            reason=reason,
+            day_name=now.strftime("%A"),
+            date_str=now.strftime("%Y-%m-%d"),
+            time_str=now.strftime("%I:%M %p"),
+            device_name=device_name or "unknown",
+            device_type=device_type or "unknown",
+            room=room or "unknown",
+            request_number=request_count_today + 1,
+            history=history,
         )
 
-        return "\n".join(parts)
-
     async def evaluate_request(
         self,
         url: str,
@@ -111,11 +130,11 @@ class LLMGatekeeper:
         )
 
         try:
-            response = self.client.messages.create(
+            response = await self.client.messages.create(
                 model=self.model,
                 max_tokens=self.max_tokens,
                 temperature=self.temperature,
-                system=self.system_prompt,
+                system=self._system_blocks,
                 messages=[{"role": "user", "content": user_message}],
             )
 
@@ -155,14 +174,10 @@ class LLMGatekeeper:
             text = "\n".join(lines).strip()
 
         try:
-            data = json.loads(text)
-            return LLMDecision(
-                approved=data.get("approved", False),
-                scope=data.get("scope", "/*"),
-                duration_minutes=data.get("duration_minutes", 15),
-                message=data.get("message", ""),
-            )
-        except (json.JSONDecodeError, KeyError) as e:
+            # Parsed and validated in one pass by pydantic-core; absent fields
+            # take LLMDecision's defaults (approved=False, i.e. DENY)
+            return LLMDecision.model_validate_json(text)
+        except ValidationError as e:
             logger.warning("Failed to parse LLM response as JSON: %s\nRaw: %s", e, raw_text)
             # If we can't parse, default to DENY
             return LLMDecision(
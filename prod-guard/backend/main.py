@@ -8,17 +8,21 @@ This is the central API that:
 - Logs all requests to SQLite for history/pattern tracking
 """
 
+import asyncio
 import logging
 import os
+import re
 from contextlib import asynccontextmanager
+from functools import lru_cache
 from pathlib import Path
+from typing import Literal, Optional
 from urllib.parse import urlparse
 
 import yaml
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 
-from blocklist import BlocklistManager
+from blocklist import BlocklistManager, www_variant
 from database import Database
 from ha_client import HAClient
 from llm_gatekeeper import LLMGatekeeper
@@ -28,10 +32,16 @@ from models import (
     DomainStatus,
     ForceBlockRequest,
     ForceUnblockRequest,
-    HistoryEntry,
+    HistoryResponse,
     StatusResponse,
 )
 
+try:
+    # libyaml's C loader, when PyYAML was built with it
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:
+    from yaml import SafeLoader as _YamlLoader
+
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s [%(name)s] %(levelname)s: %(message)s",
@@ -43,7 +53,35 @@ logger = logging.getLogger(__name__)
 CONFIG_PATH = os.environ.get("PG_CONFIG", str(Path(__file__).parent / "config.yaml"))
 
 with open(CONFIG_PATH) as f:
-    config = yaml.safe_load(f)
+    config = yaml.load(f, Loader=_YamlLoader)
+
+# Config is read once and never mutated, so the domain lists can be
+# precomputed into one per-request lookup
+DomainKind = Literal["conditional", "always_blocked"]
+
+
+def _build_domain_state(
+    conditional: list[str], always_blocked: list[str]
+) -> dict[str, tuple[DomainKind, str]]:
+    """Map each managed domain and its www/non-www variant to (kind, entry).
+
+    Within each list an exact entry maps to itself, even when it is also the
+    variant of another entry (e.g. both "reddit.com" and "www.reddit.com" are
+    listed). Conditional entries and their variants override always-blocked
+    ones, so a conditional entry's variant wins over an exact always-blocked
+    entry.
+    """
+    state: dict[str, tuple[DomainKind, str]] = {}
+    for kind, domains in (("always_blocked", always_blocked), ("conditional", conditional)):
+        state.update({www_variant(domain): (kind, domain) for domain in domains})
+        state.update({domain: (kind, domain) for domain in domains})
+    return state
+
+
+DOMAIN_STATE = _build_domain_state(
+    config["domains"]["conditional"],
+    config["domains"].get("always_blocked", []),
+)
 
 # Secrets are required via environment variables — set in .env for Docker
 anthropic_key = os.environ.get("ANTHROPIC_API_KEY")
@@ -78,8 +116,15 @@ llm = LLMGatekeeper(
     system_prompt_path=str(Path(__file__).parent / "system_prompt.txt"),
 )
 
-# Track force-blocked devices (from HA automations, e.g., phone in bedroom)
-force_blocked_devices: set[str] = set()
+# Track force-blocked devices (from HA automations, e.g., phone in bedroom).
+# Published copy-on-write: the force handlers swap in a new frozenset under
+# _force_lock, so readers test membership without copying or locking.
+force_blocked_devices: frozenset[str] = frozenset()
+_force_lock = asyncio.Lock()
+
+# Serialized /status body, keyed on blocklist.revision. The force-block
+# handlers reset it, since they change state the blocklist doesn't track.
+_status_cache: Optional[tuple[int, str]] = None
 
 
 # ── App lifecycle ────────────────────────────────────────────────────────────
@@ -93,6 +138,7 @@ async def lifespan(app: FastAPI):
     logger.info("Productivity Guard started on port %d", config["api"]["port"])
     yield
     await blocklist.reblock_all()
+    await blocklist.close()
     await ha_client.close()
     await db.close()
     logger.info("Productivity Guard shut down — all domains re-blocked")
@@ -115,30 +161,32 @@ app.add_middleware(
 
 # ── Helper ───────────────────────────────────────────────────────────────────
 
+# Fast path for the usual "scheme://host/..." URL; captures the same text as
+# urlparse's netloc
+_URL_NETLOC_RE = re.compile(r"^[a-z][a-z0-9+.-]*://([^/?#]+)", re.IGNORECASE)
+
+# Retried URLs repeat heavily within a browsing session
+EXTRACT_DOMAIN_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=EXTRACT_DOMAIN_CACHE_SIZE)
 def extract_domain(url: str) -> str:
     """Extract the domain from a URL."""
+    match = _URL_NETLOC_RE.match(url)
+    if match:
+        return match.group(1)
     parsed = urlparse(url)
     return parsed.netloc or parsed.path.split("/")[0]
 
 
-def domain_to_conditional(domain: str) -> str | None:
-    """Map a domain (possibly with www) to its conditional domain entry.
+FORCE_BLOCKED_MESSAGE = "Your device is currently force-blocked (location restriction). Access denied."
+ALWAYS_BLOCKED_MESSAGE = "This domain is permanently blocked. No exceptions."
+NOT_MANAGED_MESSAGE = "This domain is not in the managed blocklist."
 
-    Returns the matching conditional domain, or None if not found.
-    """
-    conditional = set(config["domains"]["conditional"])
-    if domain in conditional:
-        return domain
-    # Try adding/removing www
-    if domain.startswith("www."):
-        base = domain[4:]
-        if base in conditional:
-            return base
-    else:
-        www = f"www.{domain}"
-        if www in conditional:
-            return www
-    return None
+
+def _denied(message: str, domain: str) -> AccessResponse:
+    """Build a denial response; the fields are server-built, so skip validation."""
+    return AccessResponse.model_construct(approved=False, message=message, domain=domain)
 
 
 # ── Endpoints ────────────────────────────────────────────────────────────────
@@ -153,38 +201,26 @@ async def request_access(body: AccessRequest, request: Request):
 
     # Check if device is force-blocked
     if device_ip in force_blocked_devices:
-        return AccessResponse(
-            approved=False,
-            message="Your device is currently force-blocked (location restriction). Access denied.",
-            domain=domain,
-        )
+        return _denied(FORCE_BLOCKED_MESSAGE, domain)
 
     # Validate domain is in our conditional list
-    conditional_domain = domain_to_conditional(domain)
-    if not conditional_domain:
-        # Check always-blocked
-        always = set(config["domains"].get("always_blocked", []))
-        if domain in always or domain.lstrip("www.") in always:
-            return AccessResponse(
-                approved=False,
-                message="This domain is permanently blocked. No exceptions.",
-                domain=domain,
-            )
+    state = DOMAIN_STATE.get(domain)
+    if state is None:
         # Not a managed domain — shouldn't normally reach here
-        return AccessResponse(
-            approved=False,
-            message="This domain is not in the managed blocklist.",
-            domain=domain,
-        )
+        return _denied(NOT_MANAGED_MESSAGE, domain)
+    kind, conditional_domain = state
+    if kind == "always_blocked":
+        return _denied(ALWAYS_BLOCKED_MESSAGE, domain)
 
     # Gather context
     device_info = ha_client.get_device_info(device_ip)
     device_name = device_info["name"] if device_info else None
     device_type = device_info.get("type") if device_info else None
-    room = await ha_client.get_device_room(device_ip)
-    request_count = await db.get_today_count(device_ip)
-    recent = await db.get_recent_requests(limit=5, device_ip=device_ip)
-    
+    room, (request_count, recent) = await asyncio.gather(
+        ha_client.get_device_room(device_ip),
+        db.get_device_context(device_ip),
+    )
+
     user_message = llm._build_user_message(
         url=body.url,
         reason=body.reason,
@@ -211,37 +247,25 @@ async def request_access(body: AccessRequest, request: Request):
 
     # Check if device is force-blocked
     if device_ip in force_blocked_devices:
-        return AccessResponse(
-            approved=False,
-            message="Your device is currently force-blocked (location restriction). Access denied.",
-            domain=domain,
-        )
+        return _denied(FORCE_BLOCKED_MESSAGE, domain)
 
     # Validate domain is in our conditional list
-    conditional_domain = domain_to_conditional(domain)
-    if not conditional_domain:
-        # Check always-blocked
-        always = set(config["domains"].get("always_blocked", []))
-        if domain in always or domain.lstrip("www.") in always:
-            return AccessResponse(
-                approved=False,
-                message="This domain is permanently blocked. No exceptions.",
-                domain=domain,
-            )
+    state = DOMAIN_STATE.get(domain)
+    if state is None:
         # Not a managed domain — shouldn't normally reach here
-        return AccessResponse(
-            approved=False,
-            message="This domain is not in the managed blocklist.",
-            domain=domain,
-        )
+        return _denied(NOT_MANAGED_MESSAGE, domain)
+    kind, conditional_domain = state
+    if kind == "always_blocked":
+        return _denied(ALWAYS_BLOCKED_MESSAGE, domain)
 
     # Gather context
     device_info = ha_client.get_device_info(device_ip)
     device_name = device_info["name"] if device_info else None
     device_type = device_info.get("type") if device_info else None
-    room = await ha_client.get_device_room(device_ip)
-    request_count = await db.get_today_count(device_ip)
-    recent = await db.get_recent_requests(limit=5, device_ip=device_ip)
+    room, (request_count, recent) = await asyncio.gather(
+        ha_client.get_device_room(device_ip),
+        db.get_device_context(device_ip),
+    )
 
     # Call the LLM
     decision = await llm.evaluate_request(
@@ -254,6 +278,11 @@ async def request_access(body: AccessRequest, request: Request):
         recent_requests=recent,
     )
 
+    # The device may have been force-blocked while the LLM was deciding
+    if decision.approved and device_ip in force_blocked_devices:
+        decision.approved = False
+        decision.message = FORCE_BLOCKED_MESSAGE
+
     # Act on the decision
     if decision.approved:
         success = await blocklist.unblock_domain(
@@ -268,8 +297,8 @@ async def request_access(body: AccessRequest, request: Request):
             decision.approved = False
             decision.message = "Failed to unblock domain at DNS level. " + decision.message
 
-    # Log to database
-    await db.log_request(
+    # Queue the log row; Database writes it off the response path
+    db.log_request(
         device_ip=device_ip,
         device_name=device_name,
         url=body.url,
@@ -283,7 +312,7 @@ async def request_access(body: AccessRequest, request: Request):
         request_number_today=request_count + 1,
     )
 
-    return AccessResponse(
+    return AccessResponse.model_construct(
         approved=decision.approved,
         scope=decision.scope if decision.approved else None,
         duration_minutes=decision.duration_minutes if decision.approved else None,
@@ -294,23 +323,31 @@ async def request_access(body: AccessRequest, request: Request):
 
 @app.get("/status", response_model=StatusResponse)
 async def get_status():
-    """Return current state: active unblocks and force-blocked devices."""
-    active = blocklist.get_active_unblocks()
-    return StatusResponse(
-        active_unblocks=[
-            DomainStatus(
-                domain=u.domain,
-                device_ip=u.device_ip,
-                device_name=u.device_name,
-                scope=u.scope,
-                unblocked_at=u.unblocked_at,
-                expires_at=u.expires_at,
-                reason=u.reason,
-            )
-            for u in active
-        ],
-        force_blocked_devices=list(force_blocked_devices),
-    )
+    """Return current state: active unblocks and force-blocked devices.
+
+    Pollers share one serialized body until the state changes.
+    """
+    global _status_cache
+    if _status_cache is None or _status_cache[0] != blocklist.revision:
+        # Built from BlocklistManager's own records, so validation is skipped
+        active = blocklist.get_active_unblocks()
+        status = StatusResponse.model_construct(
+            active_unblocks=[
+                DomainStatus.model_construct(
+                    domain=u.domain,
+                    device_ip=u.device_ip,
+                    device_name=u.device_name,
+                    scope=u.scope,
+                    unblocked_at=u.unblocked_at,
+                    expires_at=u.expires_at,
+                    reason=u.reason,
+                )
+                for u in active
+            ],
+            force_blocked_devices=list(force_blocked_devices),
+        )
+        _status_cache = (blocklist.revision, status.model_dump_json())
+    return Response(content=_status_cache[1], media_type="application/json")
 
 
 @app.post("/revoke/{domain}")
@@ -327,9 +364,13 @@ async def revoke_all():
     return {"status": "all domains re-blocked"}
 
 
-@app.get("/history")
+@app.get("/history", response_model=HistoryResponse)
 async def get_history():
-    """Return today's request history."""
+    """Return today's request history.
+
+    With a response model, FastAPI validates and serializes the rows to JSON
+    bytes in pydantic-core in one pass.
+    """
     rows = await db.get_today_history()
     return {"requests": rows}
 
@@ -339,12 +380,16 @@ async def force_block_device(body: ForceBlockRequest):
     """Force-block a device (called by HA automations, e.g., phone in bedroom).
 
     This revokes any active approvals and auto-denies all new requests.
+    The device is published as blocked before its unblocks are revoked, and
+    the lock keeps a concurrent force-unblock from interleaving with the
+    revocation.
     """
-    force_blocked_devices.add(body.device_ip)
-    # Revoke any active unblocks for this device
-    for domain, unblock in list(blocklist.active_unblocks.items()):
-        if unblock.device_ip == body.device_ip:
-            await blocklist.reblock_domain(domain)
+    global force_blocked_devices, _status_cache
+    async with _force_lock:
+        force_blocked_devices = force_blocked_devices | {body.device_ip}
+        _status_cache = None
+        # Revoke any active unblocks for this device in one blocklist write
+        await blocklist.reblock_domains(list(blocklist.active_by_device.get(body.device_ip, ())))
     logger.info("Force-blocked device %s", body.device_ip)
     return {"status": "force-blocked", "device_ip": body.device_ip}
 
@@ -352,7 +397,10 @@ async def force_block_device(body: ForceBlockRequest):
 @app.post("/force-unblock")
 async def force_unblock_device(body: ForceUnblockRequest):
     """Remove force-block from a device (called by HA automations)."""
-    force_blocked_devices.discard(body.device_ip)
+    global force_blocked_devices, _status_cache
+    async with _force_lock:
+        force_blocked_devices = force_blocked_devices - {body.device_ip}
+        _status_cache = None
     logger.info("Removed force-block for device %s", body.device_ip)
     return {"status": "force-block removed", "device_ip": body.device_ip}
 
@@ -365,11 +413,16 @@ async def health():
 # ── Run with uvicorn ─────────────────────────────────────────────────────────
 
 if __name__ == "__main__":
+    import sys
+
     import uvicorn
 
+    # uvloop and httptools come with uvicorn[standard]; uvloop has no Windows build
     uvicorn.run(
         "main:app",
         host=config["api"]["host"],
         port=config["api"]["port"],
+        loop="asyncio" if sys.platform == "win32" else "uvloop",
+        http="httptools",
         log_level="info",
     )
@@ -23,7 +23,7 @@ class AccessResponse(BaseModel):
 
 class LLMDecision(BaseModel):
     """Parsed decision from the Claude API response."""
-    approved: bool
+    approved: bool = False
     scope: str = "/*"
     duration_minutes: int = 15
     message: str = ""
@@ -63,6 +63,11 @@ class HistoryEntry(BaseModel):
     request_number_today: int
 
 
+class HistoryResponse(BaseModel):
+    """Response for the /history endpoint."""
+    requests: list[HistoryEntry]
+
+
 class ForceBlockRequest(BaseModel):
     """Request to force-block a device (from HA automation)."""
     device_ip: str
@@ -21,9 +21,9 @@ FAKE_CONFIG = {
         "blocked_hosts_path": "/tmp/test_blocked_hosts",
     },
     "domains": {
-        # Both bare and www variants — important for domain_to_conditional tests
+        # Both bare and www variants — important for DOMAIN_STATE tests
         "conditional": ["reddit.com", "www.reddit.com", "youtube.com"],
-        # twitter.com is always-blocked — used to test the lstrip bug
+        # twitter.com is always-blocked — used to test the www-prefix check
         "always_blocked": ["twitter.com"],
     },
     "devices": {
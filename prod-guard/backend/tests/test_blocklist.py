@@ -5,10 +5,11 @@ dnsmasq reloads automatically via inotify (hostsdir) — no signaling needed.
 """
 
 import asyncio
+import time
+
 import pytest
-from unittest.mock import MagicMock
 
-from blocklist import BlocklistManager, ActiveUnblock
+from blocklist import BlocklistManager, ActiveUnblock, render_hosts
 
 
 # ── Helpers ───────────────────────────────────────────────────────────────────
@@ -39,11 +40,8 @@ async def manager(mock_write):
     """A fresh BlocklistManager with file writes mocked."""
     mgr = make_manager()
     yield mgr
-    # Cancel all lingering timer tasks to avoid asyncio warnings
-    for unblock in mgr.active_unblocks.values():
-        if unblock.timer_task and not unblock.timer_task.done():
-            unblock.timer_task.cancel()
-    await asyncio.sleep(0)
+    # Stop the re-block scheduler to avoid asyncio warnings
+    await mgr.close()
 
 
 # ── Constructor ───────────────────────────────────────────────────────────────
@@ -74,10 +72,10 @@ class TestInit:
 
 
 class TestInitialize:
-    async def test_writes_blocklist_on_startup(self, mock_write):
+    async def test_writes_both_shards_on_startup(self, mock_write):
         mgr = make_manager()
         await mgr.initialize()
-        assert mock_write.call_count == 1
+        assert mock_write.call_count == 2
 
     async def test_initial_blocklist_contains_all_domains(self, mock_write):
         mgr = make_manager(
@@ -85,9 +83,14 @@ class TestInitialize:
             always_blocked=["twitter.com"],
         )
         await mgr.initialize()
-        content = mock_write.call_args_list[0].args[0]
-        assert "reddit.com" in content
-        assert "twitter.com" in content
+        always_content = mock_write.call_args_list[0].args[0]
+        conditional_content = mock_write.call_args_list[1].args[0]
+        assert "twitter.com" in always_content
+        assert "reddit.com" in conditional_content
+
+    def test_always_blocked_shard_is_sibling_file(self):
+        mgr = make_manager(path="/fake/blocked_hosts")
+        assert str(mgr.always_blocked_path) == "/fake/blocked_hosts.always"
 
 
 # ── unblock_domain ────────────────────────────────────────────────────────────
@@ -151,7 +154,7 @@ class TestUnblockDomain:
         )
         assert result is False
 
-    async def test_timer_task_created(self, manager):
+    async def test_reblock_scheduled(self, manager):
         await manager.unblock_domain(
             domain="reddit.com",
             device_ip="192.168.1.1",
@@ -160,30 +163,35 @@ class TestUnblockDomain:
             reason="work",
             duration_minutes=10,
         )
-        task = manager.active_unblocks["reddit.com"].timer_task
-        assert task is not None
-        assert isinstance(task, asyncio.Task)
+        assert len(manager._reblock_heap) == 1
+        assert isinstance(manager._scheduler, asyncio.Task)
 
-    async def test_extending_unblock_creates_new_timer(self, mock_write):
-        """Second unblock of the same domain creates a new timer task."""
-        mgr = make_manager()
-        await mgr.unblock_domain(
+    async def test_unblocks_share_one_scheduler(self, manager):
+        await manager.unblock_domain(
+            domain="reddit.com", device_ip="1.1.1.1", device_name="dev",
+            scope="/*", reason="work", duration_minutes=10,
+        )
+        scheduler = manager._scheduler
+        await manager.unblock_domain(
+            domain="youtube.com", device_ip="1.1.1.1", device_name="dev",
+            scope="/*", reason="music", duration_minutes=5,
+        )
+        assert manager._scheduler is scheduler
+
+    async def test_extending_unblock_replaces_tracked_unblock(self, manager):
+        """Second unblock of the same domain replaces the tracked ActiveUnblock."""
+        await manager.unblock_domain(
             domain="reddit.com", device_ip="1.1.1.1", device_name="dev",
             scope="/*", reason="first", duration_minutes=10,
         )
-        first_task = mgr.active_unblocks["reddit.com"].timer_task
+        first = manager.active_unblocks["reddit.com"]
 
-        await mgr.unblock_domain(
+        await manager.unblock_domain(
             domain="reddit.com", device_ip="1.1.1.1", device_name="dev",
             scope="/*", reason="extended", duration_minutes=5,
         )
-        second_task = mgr.active_unblocks["reddit.com"].timer_task
-
-        assert second_task is not first_task
-
-        first_task.cancel()
-        second_task.cancel()
-        await asyncio.sleep(0)
+        assert manager.active_unblocks["reddit.com"] is not first
+        assert manager.active_unblocks["reddit.com"].reason == "extended"
 
     async def test_unblock_removes_domain_from_written_blocklist(self, mock_write):
         """After unblocking, the domain should not appear in the written hosts file."""
@@ -200,10 +208,7 @@ class TestUnblockDomain:
         assert "reddit.com" not in content
         assert "youtube.com" in content
 
-        for unblock in mgr.active_unblocks.values():
-            if unblock.timer_task:
-                unblock.timer_task.cancel()
-        await asyncio.sleep(0)
+        await mgr.close()
 
 
 # ── reblock_domain ────────────────────────────────────────────────────────────
@@ -247,6 +252,37 @@ class TestReblockDomain:
         await manager.reblock_domain("notblocked.com")  # should not raise
 
 
+# ── reblock_domains ───────────────────────────────────────────────────────────
+
+
+class TestReblockDomains:
+    async def test_reblocks_all_domains_and_variants(self, manager):
+        for domain in ("reddit.com", "youtube.com"):
+            await manager.unblock_domain(
+                domain=domain, device_ip="1.1.1.1", device_name="dev",
+                scope="/*", reason="work", duration_minutes=10,
+            )
+
+        await manager.reblock_domains(["reddit.com", "youtube.com"])
+        assert manager.active_unblocks == {}
+        assert "1.1.1.1" not in manager.active_by_device
+
+    async def test_single_write_for_many_domains(self, manager, mock_write):
+        for domain in ("reddit.com", "youtube.com"):
+            await manager.unblock_domain(
+                domain=domain, device_ip="1.1.1.1", device_name="dev",
+                scope="/*", reason="work", duration_minutes=10,
+            )
+        mock_write.reset_mock()
+
+        await manager.reblock_domains(["reddit.com", "youtube.com"])
+        mock_write.assert_called_once()
+
+    async def test_empty_list_skips_flush(self, manager, mock_write):
+        await manager.reblock_domains([])
+        mock_write.assert_not_called()
+
+
 # ── reblock_all ───────────────────────────────────────────────────────────────
 
 
@@ -266,6 +302,14 @@ class TestReblockAll:
         await mgr.reblock_all()
         assert mgr.active_unblocks == {}
 
+    async def test_clears_reblock_schedule(self, manager):
+        await manager.unblock_domain(
+            domain="reddit.com", device_ip="1.1.1.1", device_name="dev",
+            scope="/*", reason="work", duration_minutes=10,
+        )
+        await manager.reblock_all()
+        assert manager._reblock_heap == []
+
     async def test_writes_blocklist_after_reblock_all(self, mock_write):
         mgr = make_manager()
         initial_calls = mock_write.call_count
@@ -273,6 +317,176 @@ class TestReblockAll:
         assert mock_write.call_count > initial_calls
 
 
+# ── active_by_device index ────────────────────────────────────────────────────
+
+
+async def _unblock(mgr, domain, device_ip, minutes=10):
+    await mgr.unblock_domain(
+        domain=domain, device_ip=device_ip, device_name="dev",
+        scope="/*", reason="work", duration_minutes=minutes,
+    )
+
+
+class TestActiveByDevice:
+    async def test_unblock_indexes_domain_and_variant(self, manager):
+        await _unblock(manager, "reddit.com", "1.1.1.1")
+        assert manager.active_by_device == {"1.1.1.1": {"reddit.com", "www.reddit.com"}}
+
+    async def test_devices_indexed_separately(self, manager):
+        await _unblock(manager, "reddit.com", "1.1.1.1")
+        await _unblock(manager, "youtube.com", "2.2.2.2")
+        assert manager.active_by_device["2.2.2.2"] == {"youtube.com"}
+
+    async def test_extension_by_other_device_moves_domain(self, manager):
+        await _unblock(manager, "youtube.com", "1.1.1.1")
+        await _unblock(manager, "youtube.com", "2.2.2.2")
+        assert manager.active_by_device == {"2.2.2.2": {"youtube.com"}}
+
+    async def test_reblock_removes_device_entry(self, manager):
+        await _unblock(manager, "reddit.com", "1.1.1.1")
+        await manager.reblock_domain("www.reddit.com")
+        assert manager.active_by_device == {}
+
+    async def test_reblock_all_clears_index(self, manager):
+        await _unblock(manager, "reddit.com", "1.1.1.1")
+        await _unblock(manager, "youtube.com", "2.2.2.2")
+        await manager.reblock_all()
+        assert manager.active_by_device == {}
+
+
+class TestRevision:
+    async def test_unblock_and_reblock_bump_revision(self, manager):
+        start = manager.revision
+        await _unblock(manager, "youtube.com", "1.1.1.1")
+        after_unblock = manager.revision
+        assert after_unblock > start
+        await manager.reblock_domain("youtube.com")
+        assert manager.revision > after_unblock
+
+    async def test_noop_reblock_keeps_revision(self, manager):
+        start = manager.revision
+        await manager.reblock_domain("youtube.com")
+        assert manager.revision == start
+
+
+# ── write coalescing ──────────────────────────────────────────────────────────
+
+
+class TestFlushCoalescing:
+    async def test_concurrent_changes_share_one_write(self, mock_write):
+        mgr = make_manager()
+        await asyncio.gather(
+            mgr.unblock_domain(
+                domain="reddit.com", device_ip="1.1.1.1", device_name="dev",
+                scope="/*", reason="work", duration_minutes=10,
+            ),
+            mgr.unblock_domain(
+                domain="youtube.com", device_ip="1.1.1.1", device_name="dev",
+                scope="/*", reason="music", duration_minutes=10,
+            ),
+        )
+        assert mock_write.call_count == 1
+        content = mock_write.call_args_list[0].args[0]
+        assert "reddit.com" not in content
+        assert "youtube.com" not in content
+
+        await mgr.reblock_all()
+
+    async def test_sequential_changes_each_write(self, mock_write):
+        mgr = make_manager()
+        await mgr.unblock_domain(
+            domain="reddit.com", device_ip="1.1.1.1", device_name="dev",
+            scope="/*", reason="work", duration_minutes=10,
+        )
+        await mgr.reblock_domain("reddit.com")
+        assert mock_write.call_count == 2
+
+    async def test_write_during_slow_write_lands_last(self, mock_write):
+        landed = []
+
+        def stall_first_write(content):
+            if mock_write.call_count == 1:
+                time.sleep(0.2)
+            landed.append(content)
+
+        mock_write.side_effect = stall_first_write
+        mgr = make_manager()
+        unblock = asyncio.create_task(mgr.unblock_domain(
+            domain="reddit.com", device_ip="1.1.1.1", device_name="dev",
+            scope="/*", reason="work", duration_minutes=10,
+        ))
+        await asyncio.sleep(0.05)
+        await mgr.reblock_domain("reddit.com")
+        await unblock
+
+        assert len(landed) == 2
+        assert "0.0.0.0 reddit.com" in landed[-1]
+        await mgr.close()
+
+
+# ── re-block scheduler ────────────────────────────────────────────────────────
+
+
+class TestReblockScheduler:
+    async def test_expired_unblock_is_reblocked(self, mock_write):
+        reblocked = []
+
+        async def on_reblock(domain):
+            reblocked.append(domain)
+
+        mgr = make_manager(callback=on_reblock)
+        await mgr.unblock_domain(
+            domain="reddit.com", device_ip="1.1.1.1", device_name="dev",
+            scope="/*", reason="work", duration_minutes=0,
+        )
+        await asyncio.sleep(0.1)
+
+        assert mgr.active_unblocks == {}
+        assert mgr.active_by_device == {}
+        assert sorted(reblocked) == ["reddit.com", "www.reddit.com"]
+        assert "0.0.0.0 reddit.com" in mock_write.call_args_list[-1].args[0]
+        await mgr.close()
+
+    async def test_stale_entry_does_not_reblock_extension(self, mock_write):
+        """An expiring entry for a since-extended unblock is skipped."""
+        mgr = make_manager()
+        await mgr.unblock_domain(
+            domain="reddit.com", device_ip="1.1.1.1", device_name="dev",
+            scope="/*", reason="first", duration_minutes=0,
+        )
+        await mgr.unblock_domain(
+            domain="reddit.com", device_ip="1.1.1.1", device_name="dev",
+            scope="/*", reason="extended", duration_minutes=10,
+        )
+        await asyncio.sleep(0.1)
+
+        assert mgr.active_unblocks["reddit.com"].reason == "extended"
+        await mgr.close()
+
+    async def test_callback_error_does_not_stop_scheduler(self, mock_write):
+        async def failing_callback(domain):
+            raise RuntimeError("boom")
+
+        mgr = make_manager(callback=failing_callback)
+        await mgr.unblock_domain(
+            domain="reddit.com", device_ip="1.1.1.1", device_name="dev",
+            scope="/*", reason="work", duration_minutes=0,
+        )
+        await asyncio.sleep(0.1)
+        assert not mgr._scheduler.done()
+        await mgr.close()
+
+    async def test_close_stops_scheduler(self, manager):
+        await manager.unblock_domain(
+            domain="reddit.com", device_ip="1.1.1.1", device_name="dev",
+            scope="/*", reason="work", duration_minutes=10,
+        )
+        scheduler = manager._scheduler
+        await manager.close()
+        assert scheduler.done()
+        assert manager._scheduler is None
+
+
 # ── get_active_unblocks ────────────────────────────────────────────────────────
 
 
@@ -296,10 +510,7 @@ class TestGetActiveUnblocks:
         assert len(result) == 1
         assert result[0].domain == "reddit.com"
 
-        for u in mgr.active_unblocks.values():
-            if u.timer_task:
-                u.timer_task.cancel()
-        await asyncio.sleep(0)
+        await mgr.close()
 
     async def test_returns_correct_device_info(self, mock_write):
         mgr = make_manager()
@@ -313,10 +524,7 @@ class TestGetActiveUnblocks:
         assert result[0].device_name == "my-phone"
         assert result[0].scope == "/watch*"
 
-        for u in mgr.active_unblocks.values():
-            if u.timer_task:
-                u.timer_task.cancel()
-        await asyncio.sleep(0)
+        await mgr.close()
 
 
 # ── _get_related_domains ──────────────────────────────────────────────────────
@@ -346,6 +554,15 @@ class TestGetRelatedDomains:
         related = mgr._get_related_domains("evil.com")
         assert related == {"www.evil.com"}
 
+    def test_unlisted_www_variant_finds_listed_base(self):
+        mgr = make_manager(conditional=["youtube.com"])
+        related = mgr._get_related_domains("www.youtube.com")
+        assert related == {"youtube.com"}
+
+    def test_unrelated_domain_has_no_variants(self):
+        mgr = make_manager(conditional=["reddit.com", "www.reddit.com"])
+        assert mgr._get_related_domains("facebook.com") == set()
+
 
 # ── _write_blocklist content ──────────────────────────────────────────────────
 
@@ -365,17 +582,101 @@ class TestWriteBlocklistContent:
 
     async def test_active_unblocked_domain_absent(self, mock_write):
         mgr = make_manager(conditional=["reddit.com", "youtube.com"], always_blocked=[])
-        mgr.active_unblocks["reddit.com"] = MagicMock()
+        mgr._lift_from_blocklist({"reddit.com"})
         await mgr._write_blocklist()
         content = mock_write.call_args_list[0].args[0]
         assert "reddit.com" not in content
         assert "youtube.com" in content
 
-    async def test_always_blocked_always_present(self, mock_write):
-        mgr = make_manager(conditional=[], always_blocked=["badsite.com"])
+    async def test_reblocked_domain_returns(self, mock_write):
+        mgr = make_manager(conditional=["reddit.com", "youtube.com"], always_blocked=[])
+        mgr._lift_from_blocklist({"reddit.com"})
+        mgr._return_to_blocklist({"reddit.com"})
         await mgr._write_blocklist()
         content = mock_write.call_args_list[0].args[0]
-        assert "badsite.com" in content
+        assert "0.0.0.0 reddit.com" in content
+
+    async def test_always_blocked_www_variant_never_lifted(self, mock_write):
+        """Unblocking reddit.com must not lift an always-blocked www.reddit.com."""
+        mgr = make_manager(conditional=["reddit.com"], always_blocked=["www.reddit.com"])
+        await mgr.unblock_domain(
+            domain="reddit.com", device_ip="1.1.1.1", device_name="dev",
+            scope="/*", reason="work", duration_minutes=10,
+        )
+        await mgr.reblock_domain("reddit.com")
+        content = mock_write.call_args_list[-1].args[0]
+        assert "www.reddit.com" not in content  # lives in the always shard only
+        assert "0.0.0.0 reddit.com" in content
+        await mgr.close()
+
+    async def test_always_blocked_not_in_conditional_shard(self, mock_write):
+        mgr = make_manager(conditional=["reddit.com"], always_blocked=["badsite.com"])
+        await mgr._write_blocklist()
+        content = mock_write.call_args_list[0].args[0]
+        assert "reddit.com" in content
+        assert "badsite.com" not in content
+
+    async def test_always_blocked_present_after_unblocks(self, mock_write):
+        mgr = make_manager(conditional=["reddit.com"], always_blocked=["badsite.com"])
+        await mgr.initialize()
+        await mgr.unblock_domain(
+            domain="reddit.com", device_ip="1.1.1.1", device_name="dev",
+            scope="/*", reason="work", duration_minutes=10,
+        )
+        # Only the conditional shard is rewritten; the always shard stands
+        assert mock_write.call_count == 3
+        assert "badsite.com" in mock_write.call_args_list[0].args[0]
+
+        await mgr.close()
+
+
+# ── unchanged-set skip ────────────────────────────────────────────────────────
+
+
+class TestSkipUnchangedWrite:
+    async def test_second_write_of_same_set_skipped(self, mock_write):
+        mgr = make_manager()
+        await mgr._write_blocklist()
+        await mgr._write_blocklist()
+        assert mock_write.call_count == 1
+
+    async def test_reblock_of_blocked_domain_skips_write(self, mock_write):
+        mgr = make_manager()
+        await mgr.initialize()
+        calls_after_init = mock_write.call_count
+        await mgr.reblock_domain("reddit.com")  # never unblocked
+        assert mock_write.call_count == calls_after_init
+
+    async def test_failed_write_is_retried(self, mock_write):
+        mgr = make_manager()
+        mock_write.side_effect = OSError("disk full")
+        await mgr._write_blocklist()
+        mock_write.side_effect = None
+        await mgr._write_blocklist()
+        assert mock_write.call_count == 2
+
+
+# ── render_hosts ──────────────────────────────────────────────────────────────
+
+
+class TestRenderHosts:
+    def test_domains_rendered_in_order(self):
+        content = render_hosts(["reddit.com", "youtube.com"])
+        assert content.index("reddit.com") < content.index("youtube.com")
+
+    def test_same_list_renders_identically(self):
+        """No timestamp line — unchanged sets produce byte-identical files."""
+        assert render_hosts(["reddit.com"]) == render_hosts(["reddit.com"])
+
+    def test_empty_list_is_header_only(self):
+        assert render_hosts([]) == "# Managed by Productivity Guard — do not edit manually\n"
+
+    def test_shard_stays_sorted_across_changes(self):
+        mgr = make_manager(conditional=["a.com", "m.com", "z.com"], always_blocked=[])
+        mgr._lift_from_blocklist(["m.com", "a.com"])
+        mgr._return_to_blocklist(["m.com"])
+        mgr._return_to_blocklist(["a.com"])
+        assert mgr._blocked_conditional == ["a.com", "m.com", "z.com"]
 
 
 # ── is_domain_unblocked ────────────────────────────────────────────────────────
@@ -393,7 +694,4 @@ class TestIsDomainUnblocked:
         )
         assert mgr.is_domain_unblocked("reddit.com") is True
 
-        for u in mgr.active_unblocks.values():
-            if u.timer_task:
-                u.timer_task.cancel()
-        await asyncio.sleep(0)
+        await mgr.close()
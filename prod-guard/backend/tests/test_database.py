@@ -3,10 +3,17 @@
 No mocking — these tests exercise the actual SQL logic.
 """
 
+import aiosqlite
 import pytest
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
 
-from database import Database
+from database import (
+    DEVICE_CONTEXT_SQL,
+    MMAP_SIZE_BYTES,
+    RECENT_REQUESTS_FOR_DEVICE_SQL,
+    TODAY_HISTORY_SQL,
+    Database,
+)
 
 
 # ── Fixtures ──────────────────────────────────────────────────────────────────
@@ -40,6 +47,38 @@ def _row_kwargs(**overrides):
     return defaults
 
 
+async def _create_text_timestamp_table(path, timestamp: str):
+    """Create a database with the old TEXT-timestamp schema and one row."""
+    legacy = await aiosqlite.connect(path)
+    await legacy.execute(
+        """CREATE TABLE requests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp TEXT NOT NULL,
+            device_ip TEXT NOT NULL, device_name TEXT, url TEXT NOT NULL,
+            domain TEXT NOT NULL, reason TEXT NOT NULL, room TEXT,
+            approved INTEGER NOT NULL, scope TEXT, duration_minutes INTEGER,
+            llm_message TEXT, request_number_today INTEGER)"""
+    )
+    await legacy.execute(
+        """INSERT INTO requests (timestamp, device_ip, url, domain, reason,
+           approved, request_number_today) VALUES (?, ?, ?, ?, ?, ?, ?)""",
+        (timestamp, "1.1.1.1", "https://reddit.com", "reddit.com", "old", 1, 1),
+    )
+    await legacy.commit()
+    await legacy.close()
+
+
+def _log_during_next_execute(db, mocker, device_ip):
+    """Log a row for device_ip as the next query starts, as a concurrent request would."""
+    execute = db._db.execute
+
+    async def log_then_execute(*args):
+        mock.side_effect = execute
+        db.log_request(**_row_kwargs(device_ip=device_ip))
+        return await execute(*args)
+
+    mock = mocker.patch.object(db._db, "execute", side_effect=log_then_execute)
+
+
 # ── connect / schema ──────────────────────────────────────────────────────────
 
 
@@ -60,38 +99,163 @@ class TestConnect:
         await d.connect()  # re-runs CREATE TABLE IF NOT EXISTS — should be fine
         await d.close()
 
+    async def test_creates_indexes(self, db):
+        cursor = await db._db.execute(
+            "SELECT name FROM sqlite_master WHERE type='index' AND tbl_name='requests'"
+        )
+        names = {row[0] for row in await cursor.fetchall()}
+        assert {"idx_requests_timestamp", "idx_requests_device_timestamp"} <= names
+
+    async def test_today_count_query_uses_index(self, db):
+        cursor = await db._db.execute(
+            "EXPLAIN QUERY PLAN SELECT COUNT(*) FROM requests "
+            "WHERE device_ip = ? AND timestamp >= ? AND timestamp < ?",
+            ("1.1.1.1", 0, 86400),
+        )
+        plan = " ".join(row[3] for row in await cursor.fetchall())
+        assert "idx_requests_device_timestamp" in plan
+
+    @pytest.mark.parametrize("sql", [
+        RECENT_REQUESTS_FOR_DEVICE_SQL, TODAY_HISTORY_SQL, DEVICE_CONTEXT_SQL,
+    ])
+    async def test_filtered_reads_need_no_sort(self, db, sql):
+        cursor = await db._db.execute(
+            f"EXPLAIN QUERY PLAN {sql}", (1,) * sql.count("?")
+        )
+        plan = " ".join(row[3] for row in await cursor.fetchall())
+        assert "USING INDEX" in plan
+        assert "TEMP B-TREE" not in plan
+
+    async def test_migrates_text_timestamps(self, tmp_path):
+        """A table from before the INTEGER schema is rebuilt with rows preserved."""
+        path = tmp_path / "requests.db"
+        await _create_text_timestamp_table(path, "2024-02-06T20:15:30.123456")
+
+        d = Database(str(path))
+        await d.connect()
+        cursor = await d._db.execute("SELECT typeof(timestamp) FROM requests")
+        assert (await cursor.fetchone())[0] == "integer"
+        rows = await d.get_recent_requests()
+        assert rows[0]["timestamp"] == "2024-02-06T20:15:30"
+        assert rows[0]["reason"] == "old"
+        await d.close()
+
+    async def test_failed_migration_keeps_text_table(self, tmp_path):
+        """A copy that fails part-way rolls back the rename as well."""
+        path = tmp_path / "requests.db"
+        # strftime yields NULL here, which the INTEGER schema's NOT NULL rejects
+        await _create_text_timestamp_table(path, "not a timestamp")
+
+        d = Database(str(path))
+        with pytest.raises(aiosqlite.IntegrityError):
+            await d.connect()
+        await d._db.close()
+
+        conn = await aiosqlite.connect(path)
+        cursor = await conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+        tables = {row[0] for row in await cursor.fetchall()}
+        cursor = await conn.execute("SELECT timestamp FROM requests")
+        rows = await cursor.fetchall()
+        await conn.close()
+        assert "requests_text_timestamps" not in tables
+        assert rows == [("not a timestamp",)]
+
+    async def test_file_database_uses_wal(self, tmp_path):
+        d = Database(str(tmp_path / "requests.db"))
+        await d.connect()
+        cursor = await d._db.execute("PRAGMA journal_mode")
+        row = await cursor.fetchone()
+        assert row[0] == "wal"
+        await d.close()
+
+    async def test_file_database_uses_mmap(self, tmp_path):
+        d = Database(str(tmp_path / "requests.db"))
+        await d.connect()
+        cursor = await d._db.execute("PRAGMA mmap_size")
+        row = await cursor.fetchone()
+        assert row[0] == MMAP_SIZE_BYTES
+        await d.close()
+
 
 # ── log_request ───────────────────────────────────────────────────────────────
 
 
 class TestLogRequest:
-    async def test_returns_integer_row_id(self, db):
-        row_id = await db.log_request(**_row_kwargs())
-        assert isinstance(row_id, int)
-        assert row_id >= 1
+    async def test_queues_without_writing(self, db):
+        assert db.log_request(**_row_kwargs()) is None
+        cursor = await db._db.execute("SELECT COUNT(*) FROM requests")
+        assert (await cursor.fetchone())[0] == 0
+        await db.flush()
+        cursor = await db._db.execute("SELECT COUNT(*) FROM requests")
+        assert (await cursor.fetchone())[0] == 1
+
+    async def test_queued_rows_written_after_delay(self, db, mocker):
+        mocker.patch("database.LOG_FLUSH_DELAY_SECONDS", 0)
+        db.log_request(**_row_kwargs())
+        await db._pending_flush
+        cursor = await db._db.execute("SELECT COUNT(*) FROM requests")
+        assert (await cursor.fetchone())[0] == 1
+
+    async def test_queued_rows_share_one_batch_and_commit(self, db, mocker):
+        executemany = mocker.spy(db._db, "executemany")
+        commit = mocker.spy(db._db, "commit")
+        for _ in range(5):
+            db.log_request(**_row_kwargs())
+        await db.flush()
+        executemany.assert_called_once()
+        commit.assert_called_once()
+        assert await db.get_today_count() == 5
+
+    async def test_reads_see_queued_rows(self, db):
+        db.log_request(**_row_kwargs())
+        assert len(await db.get_recent_requests()) == 1
+        assert len(await db.get_today_history()) == 1
+
+    async def test_close_writes_queued_rows(self, tmp_path):
+        path = str(tmp_path / "requests.db")
+        d = Database(path)
+        await d.connect()
+        d.log_request(**_row_kwargs())
+        await d.close()
+
+        d = Database(path)
+        await d.connect()
+        assert await d.get_today_count() == 1
+        await d.close()
+
+    async def test_failed_write_requeues_rows(self, db, mocker):
+        db.log_request(**_row_kwargs(reason="first"))
+        mocker.patch.object(
+            db._db, "executemany", side_effect=aiosqlite.OperationalError("database is locked")
+        )
+        with pytest.raises(aiosqlite.OperationalError):
+            await db.flush()
+        assert len(db._log_queue) == 1
 
-    async def test_row_id_increments(self, db):
-        id1 = await db.log_request(**_row_kwargs())
-        id2 = await db.log_request(**_row_kwargs())
-        assert id2 > id1
+        mocker.stopall()
+        db.log_request(**_row_kwargs(reason="second"))
+        assert [r["reason"] for r in await db.get_recent_requests()] == ["second", "first"]
 
     async def test_approved_true_stored_as_1(self, db):
-        await db.log_request(**_row_kwargs(approved=True))
+        db.log_request(**_row_kwargs(approved=True))
+        await db.flush()
         cursor = await db._db.execute("SELECT approved FROM requests LIMIT 1")
         row = await cursor.fetchone()
         assert row[0] == 1
 
     async def test_approved_false_stored_as_0(self, db):
-        await db.log_request(**_row_kwargs(approved=False))
+        db.log_request(**_row_kwargs(approved=False))
+        await db.flush()
         cursor = await db._db.execute("SELECT approved FROM requests LIMIT 1")
         row = await cursor.fetchone()
         assert row[0] == 0
 
     async def test_nullable_fields_stored_as_none(self, db):
-        await db.log_request(**_row_kwargs(
+        db.log_request(**_row_kwargs(
             device_name=None, room=None, scope=None,
             duration_minutes=None, llm_message=None,
         ))
+        await db.flush()
         cursor = await db._db.execute(
             "SELECT device_name, room, scope, duration_minutes, llm_message FROM requests LIMIT 1"
         )
@@ -101,7 +265,7 @@ class TestLogRequest:
         assert row[2] is None  # scope
 
     async def test_all_fields_stored(self, db):
-        await db.log_request(**_row_kwargs(
+        db.log_request(**_row_kwargs(
             device_ip="10.0.0.1",
             device_name="my-phone",
             url="https://youtube.com/watch?v=abc",
@@ -114,6 +278,7 @@ class TestLogRequest:
             llm_message="Approved for music",
             request_number_today=3,
         ))
+        await db.flush()
         cursor = await db._db.execute("SELECT * FROM requests LIMIT 1")
         row = dict(await cursor.fetchone())
         assert row["device_ip"] == "10.0.0.1"
@@ -136,15 +301,15 @@ class TestGetTodayCount:
         assert count == 0
 
     async def test_counts_todays_rows(self, db):
-        await db.log_request(**_row_kwargs())
-        await db.log_request(**_row_kwargs())
+        db.log_request(**_row_kwargs())
+        db.log_request(**_row_kwargs())
         count = await db.get_today_count()
         assert count == 2
 
     async def test_filters_by_device_ip(self, db):
-        await db.log_request(**_row_kwargs(device_ip="10.0.0.1"))
-        await db.log_request(**_row_kwargs(device_ip="10.0.0.2"))
-        await db.log_request(**_row_kwargs(device_ip="10.0.0.2"))
+        db.log_request(**_row_kwargs(device_ip="10.0.0.1"))
+        db.log_request(**_row_kwargs(device_ip="10.0.0.2"))
+        db.log_request(**_row_kwargs(device_ip="10.0.0.2"))
 
         count_1 = await db.get_today_count("10.0.0.1")
         count_2 = await db.get_today_count("10.0.0.2")
@@ -153,7 +318,7 @@ class TestGetTodayCount:
 
     async def test_does_not_count_other_days(self, db):
         # Insert a row with yesterday's timestamp directly
-        yesterday = "2000-01-01T12:00:00"
+        yesterday = int(datetime(2000, 1, 1, 12).timestamp())
         await db._db.execute(
             """INSERT INTO requests (timestamp, device_ip, device_name, url, domain,
                reason, room, approved, scope, duration_minutes, llm_message, request_number_today)
@@ -165,6 +330,50 @@ class TestGetTodayCount:
         count = await db.get_today_count()
         assert count == 0  # yesterday's row should not be counted
 
+    async def test_does_not_count_tomorrow(self, db):
+        tomorrow = int(datetime.combine(date.today() + timedelta(days=1), datetime.min.time()).timestamp())
+        await db._db.execute(
+            """INSERT INTO requests (timestamp, device_ip, device_name, url, domain,
+               reason, room, approved, scope, duration_minutes, llm_message, request_number_today)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (tomorrow, "1.1.1.1", "dev", "https://reddit.com", "reddit.com",
+             "test", None, 1, None, None, None, 1),
+        )
+        await db._db.commit()
+        assert await db.get_today_count() == 0
+
+    async def test_log_request_updates_seeded_counts(self, db):
+        db.log_request(**_row_kwargs(device_ip="10.0.0.1"))
+        assert await db.get_today_count() == 1
+        assert await db.get_today_count("10.0.0.1") == 1
+
+        db.log_request(**_row_kwargs(device_ip="10.0.0.1"))
+        db.log_request(**_row_kwargs(device_ip="10.0.0.2"))
+        assert await db.get_today_count() == 3
+        assert await db.get_today_count("10.0.0.1") == 2
+        assert await db.get_today_count("10.0.0.2") == 1
+
+    async def test_seeded_count_skips_sql(self, db, mocker):
+        db.log_request(**_row_kwargs())
+        await db.get_today_count()
+        spy = mocker.spy(db._db, "execute")
+        assert await db.get_today_count() == 1
+        spy.assert_not_called()
+
+    async def test_counts_reseed_on_new_day(self, db):
+        db.log_request(**_row_kwargs())
+        assert await db.get_today_count() == 1
+        # Pretend the cached counts were taken on an earlier day
+        db._today_date = date.today() - timedelta(days=1)
+        db._today_counts[None] = 99
+        assert await db.get_today_count() == 1
+
+    async def test_row_logged_while_seeding_is_counted(self, db, mocker):
+        _log_during_next_execute(db, mocker, "1.1.1.1")
+        assert await db.get_today_count("1.1.1.1") == 1
+        db.log_request(**_row_kwargs(device_ip="1.1.1.1"))
+        assert await db.get_today_count("1.1.1.1") == 2
+
 
 # ── get_recent_requests ───────────────────────────────────────────────────────
 
@@ -174,29 +383,34 @@ class TestGetRecentRequests:
         result = await db.get_recent_requests()
         assert result == []
 
+    async def test_timestamp_returned_as_iso_string(self, db):
+        db.log_request(**_row_kwargs())
+        result = await db.get_recent_requests()
+        assert datetime.fromisoformat(result[0]["timestamp"]).date() == date.today()
+
     async def test_returns_list_of_dicts(self, db):
-        await db.log_request(**_row_kwargs())
+        db.log_request(**_row_kwargs())
         result = await db.get_recent_requests()
         assert isinstance(result, list)
         assert isinstance(result[0], dict)
 
     async def test_respects_limit(self, db):
         for i in range(10):
-            await db.log_request(**_row_kwargs(reason=f"request {i}"))
+            db.log_request(**_row_kwargs(reason=f"request {i}"))
         result = await db.get_recent_requests(limit=3)
         assert len(result) == 3
 
     async def test_ordered_newest_first(self, db):
         for i in range(5):
-            await db.log_request(**_row_kwargs(reason=f"request {i}"))
+            db.log_request(**_row_kwargs(reason=f"request {i}"))
         result = await db.get_recent_requests(limit=5)
         ids = [r["id"] for r in result]
         assert ids == sorted(ids, reverse=True)
 
     async def test_filters_by_device_ip(self, db):
-        await db.log_request(**_row_kwargs(device_ip="1.1.1.1"))
-        await db.log_request(**_row_kwargs(device_ip="2.2.2.2"))
-        await db.log_request(**_row_kwargs(device_ip="1.1.1.1"))
+        db.log_request(**_row_kwargs(device_ip="1.1.1.1"))
+        db.log_request(**_row_kwargs(device_ip="2.2.2.2"))
+        db.log_request(**_row_kwargs(device_ip="1.1.1.1"))
 
         result = await db.get_recent_requests(device_ip="1.1.1.1")
         assert len(result) == 2
@@ -204,12 +418,71 @@ class TestGetRecentRequests:
             assert row["device_ip"] == "1.1.1.1"
 
     async def test_returns_all_when_under_limit(self, db):
-        await db.log_request(**_row_kwargs())
-        await db.log_request(**_row_kwargs())
+        db.log_request(**_row_kwargs())
+        db.log_request(**_row_kwargs())
         result = await db.get_recent_requests(limit=10)
         assert len(result) == 2
 
 
+# ── get_device_context ────────────────────────────────────────────────────────
+
+
+class TestGetDeviceContext:
+    async def test_empty_when_no_rows(self, db):
+        assert await db.get_device_context("1.1.1.1") == (0, [])
+
+    async def test_returns_count_and_recent_for_device(self, db):
+        db.log_request(**_row_kwargs(device_ip="1.1.1.1", reason="first"))
+        db.log_request(**_row_kwargs(device_ip="2.2.2.2"))
+        db.log_request(**_row_kwargs(device_ip="1.1.1.1", reason="second"))
+
+        count, recent = await db.get_device_context("1.1.1.1")
+        assert count == 2
+        assert [r["reason"] for r in recent] == ["second", "first"]
+        assert "today_count" not in recent[0]
+
+    async def test_recent_includes_other_days_but_count_does_not(self, db):
+        yesterday = int(datetime(2000, 1, 1, 12).timestamp())
+        await db._db.execute(
+            """INSERT INTO requests (timestamp, device_ip, device_name, url, domain,
+               reason, room, approved, scope, duration_minutes, llm_message, request_number_today)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (yesterday, "1.1.1.1", "dev", "https://reddit.com", "reddit.com",
+             "test", None, 1, None, None, None, 1),
+        )
+        db.log_request(**_row_kwargs(device_ip="1.1.1.1"))
+
+        count, recent = await db.get_device_context("1.1.1.1")
+        assert count == 1
+        assert len(recent) == 2
+
+    async def test_respects_limit(self, db):
+        for _ in range(4):
+            db.log_request(**_row_kwargs(device_ip="1.1.1.1"))
+        count, recent = await db.get_device_context("1.1.1.1", limit=3)
+        assert count == 4
+        assert len(recent) == 3
+
+    async def test_seeds_count_then_uses_one_query(self, db, mocker):
+        db.log_request(**_row_kwargs(device_ip="1.1.1.1"))
+        await db.get_device_context("1.1.1.1")
+        assert db._today_counts["1.1.1.1"] == 1
+
+        db.log_request(**_row_kwargs(device_ip="1.1.1.1"))
+        spy = mocker.spy(db._db, "execute")
+        count, recent = await db.get_device_context("1.1.1.1")
+        assert count == 2
+        assert len(recent) == 2
+        spy.assert_called_once()
+
+    async def test_row_logged_while_seeding_is_counted(self, db, mocker):
+        _log_during_next_execute(db, mocker, "1.1.1.1")
+        count, recent = await db.get_device_context("1.1.1.1")
+        assert count == 1
+        assert recent == []
+        assert await db.get_today_count("1.1.1.1") == 1
+
+
 # ── get_today_history ──────────────────────────────────────────────────────────
 
 
@@ -219,13 +492,13 @@ class TestGetTodayHistory:
         assert result == []
 
     async def test_returns_todays_rows(self, db):
-        await db.log_request(**_row_kwargs())
+        db.log_request(**_row_kwargs())
         result = await db.get_today_history()
         assert len(result) == 1
 
     async def test_excludes_other_days(self, db):
         # Insert yesterday's row manually
-        yesterday = "2000-01-01T12:00:00"
+        yesterday = int(datetime(2000, 1, 1, 12).timestamp())
         await db._db.execute(
             """INSERT INTO requests (timestamp, device_ip, device_name, url, domain,
                reason, room, approved, scope, duration_minutes, llm_message, request_number_today)
@@ -235,7 +508,7 @@ class TestGetTodayHistory:
         )
         await db._db.commit()
         # Add today's row
-        await db.log_request(**_row_kwargs())
+        db.log_request(**_row_kwargs())
 
         result = await db.get_today_history()
         assert len(result) == 1
@@ -243,7 +516,7 @@ class TestGetTodayHistory:
 
     async def test_ordered_newest_first(self, db):
         for i in range(3):
-            await db.log_request(**_row_kwargs(reason=f"req {i}"))
+            db.log_request(**_row_kwargs(reason=f"req {i}"))
         result = await db.get_today_history()
         ids = [r["id"] for r in result]
         assert ids == sorted(ids, reverse=True)
@@ -3,11 +3,20 @@
 The httpx.AsyncClient is mocked directly — no real HTTP calls are made.
 """
 
+import asyncio
+
 import pytest
 import httpx
+import orjson
 from unittest.mock import AsyncMock, MagicMock
 
-from ha_client import HAClient
+from ha_client import (
+    HAClient,
+    HTTP_KEEPALIVE_EXPIRY_SECONDS,
+    HTTP_MAX_CONNECTIONS,
+    STATE_CACHE_SWEEP_SECONDS,
+    STATE_CACHE_TTL_SECONDS,
+)
 
 
 # ── Fixtures ──────────────────────────────────────────────────────────────────
@@ -49,6 +58,7 @@ def _mock_response(status_code: int, json_body: dict) -> MagicMock:
     resp = MagicMock(spec=httpx.Response)
     resp.status_code = status_code
     resp.json.return_value = json_body
+    resp.content = orjson.dumps(json_body)
     resp.text = str(json_body)
     return resp
 
@@ -168,6 +178,76 @@ class TestGetEntityState:
         )
 
 
+# ── state cache ───────────────────────────────────────────────────────────────
+
+
+class TestStateCache:
+    async def test_repeat_lookup_within_ttl_is_cached(self, ha_connected):
+        ha_connected._client.get.return_value = _mock_response(
+            200, {"state": "office"}
+        )
+        assert await ha_connected._get_entity_state("sensor.test") == "office"
+        assert await ha_connected._get_entity_state("sensor.test") == "office"
+        ha_connected._client.get.assert_called_once()
+
+    async def test_expired_entry_is_refetched(self, ha_connected):
+        ha_connected._client.get.return_value = _mock_response(
+            200, {"state": "office"}
+        )
+        await ha_connected._get_entity_state("sensor.test")
+        fetched_at, state = ha_connected._state_cache["sensor.test"]
+        ha_connected._state_cache["sensor.test"] = (
+            fetched_at - STATE_CACHE_TTL_SECONDS - 1, state
+        )
+
+        ha_connected._client.get.return_value = _mock_response(
+            200, {"state": "bedroom"}
+        )
+        assert await ha_connected._get_entity_state("sensor.test") == "bedroom"
+        assert ha_connected._client.get.call_count == 2
+
+    async def test_entities_are_cached_separately(self, ha_connected):
+        ha_connected._client.get.return_value = _mock_response(
+            200, {"state": "office"}
+        )
+        await ha_connected._get_entity_state("sensor.a")
+        await ha_connected._get_entity_state("sensor.b")
+        assert ha_connected._client.get.call_count == 2
+
+    async def test_sweep_drops_expired_entries(self, ha_connected):
+        ha_connected._client.get.return_value = _mock_response(
+            200, {"state": "office"}
+        )
+        await ha_connected._get_entity_state("sensor.old")
+        fetched_at, state = ha_connected._state_cache["sensor.old"]
+        ha_connected._state_cache["sensor.old"] = (
+            fetched_at - STATE_CACHE_TTL_SECONDS - 1, state
+        )
+        ha_connected._last_cache_sweep -= STATE_CACHE_SWEEP_SECONDS
+
+        await ha_connected._get_entity_state("sensor.new")
+        assert set(ha_connected._state_cache) == {"sensor.new"}
+
+    async def test_concurrent_misses_share_one_request(self, ha_connected):
+        release = asyncio.Event()
+
+        async def slow_get(path):
+            await release.wait()
+            return _mock_response(200, {"state": "office"})
+
+        ha_connected._client.get.side_effect = slow_get
+        lookups = [
+            asyncio.create_task(ha_connected._get_entity_state("sensor.test"))
+            for _ in range(3)
+        ]
+        await asyncio.sleep(0)
+        release.set()
+
+        assert await asyncio.gather(*lookups) == ["office"] * 3
+        ha_connected._client.get.assert_called_once()
+        assert ha_connected._pending_states == {}
+
+
 # ── connect / close ───────────────────────────────────────────────────────────
 
 
@@ -185,6 +265,16 @@ class TestConnectClose:
         await ha.connect()
         assert ha._client is mock_client
 
+    async def test_connect_configures_keepalive_pool(self, ha, mocker):
+        mock_client = AsyncMock(spec=httpx.AsyncClient)
+        mock_client.get.return_value = _mock_response(200, {})
+        client_cls = mocker.patch("ha_client.httpx.AsyncClient", return_value=mock_client)
+
+        await ha.connect()
+        limits = client_cls.call_args.kwargs["limits"]
+        assert limits.max_keepalive_connections == HTTP_MAX_CONNECTIONS
+        assert limits.keepalive_expiry == HTTP_KEEPALIVE_EXPIRY_SECONDS
+
     async def test_connect_handles_connection_failure_gracefully(self, ha, mocker):
         """If the HA connection test fails, connect() should not raise — it warns."""
         mock_client = AsyncMock(spec=httpx.AsyncClient)
@@ -1,16 +1,11 @@
 """Unit tests for LLMGatekeeper.
 
 The Anthropic API is stubbed throughout — no real API calls are made.
-
-Known issue this file documents:
-- evaluate_request() is `async` but calls the SYNCHRONOUS anthropic.Anthropic
-  client (messages.create), not AsyncAnthropic. This blocks the event loop.
-  Tests verify the sync method is called, not an async variant.
 """
 
 import pytest
 import httpx
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 import anthropic
 
 from llm_gatekeeper import LLMGatekeeper
@@ -86,12 +81,22 @@ class TestParseResponse:
         assert result.approved is False
         assert "Could not parse" in result.message
 
+    def test_non_object_json_returns_deny(self, gatekeeper):
+        result = gatekeeper._parse_response('["approved", true]')
+        assert result.approved is False
+        assert "Could not parse" in result.message
+
+    def test_wrong_field_type_returns_deny(self, gatekeeper):
+        result = gatekeeper._parse_response('{"approved": true, "duration_minutes": "forever"}')
+        assert result.approved is False
+        assert "Could not parse" in result.message
+
     def test_empty_string_returns_deny(self, gatekeeper):
         result = gatekeeper._parse_response("")
         assert result.approved is False
 
     def test_missing_approved_key_defaults_to_false(self, gatekeeper):
-        # data.get("approved", False) — should default to False when key absent
+        # LLMDecision.approved defaults to False when the key is absent
         result = gatekeeper._parse_response(
             '{"scope": "/*", "duration_minutes": 10, "message": "something"}'
         )
@@ -204,7 +209,7 @@ class TestBuildUserMessage:
 
 class TestEvaluateRequest:
     async def test_approved_response_returned(self, gatekeeper):
-        gatekeeper.client.messages.create = MagicMock(
+        gatekeeper.client.messages.create = AsyncMock(
             return_value=_mock_llm_response(
                 '{"approved": true, "scope": "/r/python/*", "duration_minutes": 20, "message": "Approved"}'
             )
@@ -218,7 +223,7 @@ class TestEvaluateRequest:
         assert result.duration_minutes == 20
 
     async def test_denied_response_returned(self, gatekeeper):
-        gatekeeper.client.messages.create = MagicMock(
+        gatekeeper.client.messages.create = AsyncMock(
             return_value=_mock_llm_response(
                 '{"approved": false, "scope": "/*", "duration_minutes": 0, "message": "Not productive"}'
             )
@@ -230,7 +235,7 @@ class TestEvaluateRequest:
         assert result.approved is False
 
     async def test_fenced_response_still_parsed(self, gatekeeper):
-        gatekeeper.client.messages.create = MagicMock(
+        gatekeeper.client.messages.create = AsyncMock(
             return_value=_mock_llm_response(
                 '```json\n{"approved": true, "scope": "/*", "duration_minutes": 15, "message": "ok"}\n```'
             )
@@ -242,7 +247,7 @@ class TestEvaluateRequest:
 
     async def test_api_connection_error_returns_deny(self, gatekeeper):
         request = httpx.Request("POST", "https://api.anthropic.com/v1/messages")
-        gatekeeper.client.messages.create = MagicMock(
+        gatekeeper.client.messages.create = AsyncMock(
             side_effect=anthropic.APIConnectionError(request=request)
         )
         result = await gatekeeper.evaluate_request(
@@ -252,7 +257,7 @@ class TestEvaluateRequest:
         assert "error" in result.message.lower()
 
     async def test_unexpected_exception_returns_deny(self, gatekeeper):
-        gatekeeper.client.messages.create = MagicMock(
+        gatekeeper.client.messages.create = AsyncMock(
             side_effect=RuntimeError("Unexpected failure")
         )
         result = await gatekeeper.evaluate_request(
@@ -261,23 +266,19 @@ class TestEvaluateRequest:
         assert result.approved is False
         assert result.message  # some message is set
 
-    async def test_uses_synchronous_messages_create(self, gatekeeper):
-        """evaluate_request calls the SYNC client (anthropic.Anthropic), not AsyncAnthropic.
-
-        This documents the current design: the blocking sync HTTP call runs inside
-        an async function, which blocks the event loop during each LLM request.
-        """
-        gatekeeper.client.messages.create = MagicMock(
+    async def test_awaits_async_messages_create(self, gatekeeper):
+        """evaluate_request awaits the AsyncAnthropic client so the event loop stays free."""
+        assert isinstance(gatekeeper.client, anthropic.AsyncAnthropic)
+        gatekeeper.client.messages.create = AsyncMock(
             return_value=_mock_llm_response(
                 '{"approved": false, "scope": "/*", "duration_minutes": 0, "message": "denied"}'
             )
         )
         await gatekeeper.evaluate_request(url="https://reddit.com", reason="test")
-        # The SYNC create was called exactly once
-        gatekeeper.client.messages.create.assert_called_once()
+        gatekeeper.client.messages.create.assert_awaited_once()
 
     async def test_api_called_with_model_and_system_prompt(self, gatekeeper):
-        mock_create = MagicMock(
+        mock_create = AsyncMock(
             return_value=_mock_llm_response(
                 '{"approved": false, "scope": "/*", "duration_minutes": 0, "message": "no"}'
             )
@@ -287,11 +288,17 @@ class TestEvaluateRequest:
 
         call_kwargs = mock_create.call_args.kwargs
         assert call_kwargs["model"] == "claude-test"
-        assert call_kwargs["system"] == gatekeeper.system_prompt
+        assert call_kwargs["system"] == [
+            {
+                "type": "text",
+                "text": gatekeeper.system_prompt,
+                "cache_control": {"type": "ephemeral"},
+            }
+        ]
         assert call_kwargs["messages"][0]["role"] == "user"
 
     async def test_api_called_with_max_tokens_and_temperature(self, gatekeeper):
-        mock_create = MagicMock(
+        mock_create = AsyncMock(
             return_value=_mock_llm_response(
                 '{"approved": false, "scope": "/*", "duration_minutes": 0, "message": "no"}'
             )
@@ -304,7 +311,7 @@ class TestEvaluateRequest:
         assert call_kwargs["temperature"] == 0.0  # matches fixture (temperature=0.0)
 
     async def test_user_message_contains_url_and_reason(self, gatekeeper):
-        mock_create = MagicMock(
+        mock_create = AsyncMock(
             return_value=_mock_llm_response(
                 '{"approved": false, "scope": "/*", "duration_minutes": 0, "message": "no"}'
             )
@@ -321,7 +328,7 @@ class TestEvaluateRequest:
         assert "my-laptop" in user_content
 
     async def test_user_message_contains_room(self, gatekeeper):
-        mock_create = MagicMock(
+        mock_create = AsyncMock(
             return_value=_mock_llm_response(
                 '{"approved": false, "scope": "/*", "duration_minutes": 0, "message": "no"}'
             )
@@ -336,7 +343,7 @@ class TestEvaluateRequest:
         assert "living_room" in user_content
 
     async def test_user_message_contains_request_count(self, gatekeeper):
-        mock_create = MagicMock(
+        mock_create = AsyncMock(
             return_value=_mock_llm_response(
                 '{"approved": false, "scope": "/*", "duration_minutes": 0, "message": "no"}'
             )
@@ -351,7 +358,7 @@ class TestEvaluateRequest:
         assert "Request #5 today" in user_content
 
     async def test_user_message_contains_recent_requests(self, gatekeeper):
-        mock_create = MagicMock(
+        mock_create = AsyncMock(
             return_value=_mock_llm_response(
                 '{"approved": false, "scope": "/*", "duration_minutes": 0, "message": "no"}'
             )
@@ -375,7 +382,7 @@ class TestEvaluateRequest:
         assert "[APPROVED]" in user_content
 
     async def test_user_message_contains_device_type(self, gatekeeper):
-        mock_create = MagicMock(
+        mock_create = AsyncMock(
             return_value=_mock_llm_response(
                 '{"approved": false, "scope": "/*", "duration_minutes": 0, "message": "no"}'
             )
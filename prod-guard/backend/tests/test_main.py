@@ -5,10 +5,11 @@ main.py executes `open(CONFIG_PATH)` at module level. The session-scoped
 `set_config_env` fixture in conftest.py sets PG_CONFIG before any import occurs.
 
 Known issues documented by these tests:
-1. `domain.lstrip("www.")` bug — strips individual chars, not a string prefix
-2. Duplicate `request_access` function name — both endpoints named the same
+1. Duplicate `request_access` function name — both endpoints named the same
 """
 
+import asyncio
+
 import pytest
 from unittest.mock import AsyncMock, MagicMock
 
@@ -43,16 +44,17 @@ def client(main_module, mocker):
     mocker.patch.object(main_module.ha_client, "close", new=AsyncMock())
     mocker.patch.object(main_module.blocklist, "initialize", new=AsyncMock())
     mocker.patch.object(main_module.blocklist, "reblock_all", new=AsyncMock())
+    mocker.patch.object(main_module.blocklist, "close", new=AsyncMock())
 
     # Per-request dependencies — sensible defaults (all deny / empty)
-    mocker.patch.object(main_module.db, "get_today_count", new=AsyncMock(return_value=0))
-    mocker.patch.object(main_module.db, "get_recent_requests", new=AsyncMock(return_value=[]))
-    mocker.patch.object(main_module.db, "log_request", new=AsyncMock(return_value=1))
+    mocker.patch.object(main_module.db, "get_device_context", new=AsyncMock(return_value=(0, [])))
+    mocker.patch.object(main_module.db, "log_request", return_value=None)
     mocker.patch.object(main_module.db, "get_today_history", new=AsyncMock(return_value=[]))
     mocker.patch.object(main_module.ha_client, "get_device_info", return_value=None)
     mocker.patch.object(main_module.ha_client, "get_device_room", new=AsyncMock(return_value=None))
     mocker.patch.object(main_module.blocklist, "unblock_domain", new=AsyncMock(return_value=True))
     mocker.patch.object(main_module.blocklist, "reblock_domain", new=AsyncMock())
+    mocker.patch.object(main_module.blocklist, "reblock_domains", new=AsyncMock())
     mocker.patch.object(main_module.blocklist, "get_active_unblocks", return_value=[])
 
     # Default LLM response: DENY
@@ -63,15 +65,18 @@ def client(main_module, mocker):
     )
 
     # Reset module-level state between tests
-    main_module.force_blocked_devices.clear()
+    main_module.force_blocked_devices = frozenset()
+    main_module._status_cache = None
     main_module.blocklist.active_unblocks.clear()
+    main_module.blocklist.active_by_device.clear()
 
     with TestClient(main_module.app) as c:
         yield c
 
     # Clean up state after test too
-    main_module.force_blocked_devices.clear()
+    main_module.force_blocked_devices = frozenset()
     main_module.blocklist.active_unblocks.clear()
+    main_module.blocklist.active_by_device.clear()
 
 
 # ── Helper ────────────────────────────────────────────────────────────────────
@@ -104,39 +109,55 @@ class TestExtractDomain:
     def test_url_with_path_and_query(self, main_module):
         assert main_module.extract_domain("https://reddit.com/r/esp32/comments/abc") == "reddit.com"
 
+    def test_url_with_query_and_no_path(self, main_module):
+        assert main_module.extract_domain("https://reddit.com?ref=home") == "reddit.com"
+
+    def test_url_with_port_matches_urlparse_netloc(self, main_module):
+        assert main_module.extract_domain("http://localhost:8800/status") == "localhost:8800"
+
+    def test_repeat_url_served_from_cache(self, main_module):
+        main_module.extract_domain.cache_clear()
+        main_module.extract_domain("https://reddit.com/r/python")
+        main_module.extract_domain("https://reddit.com/r/python")
+        assert main_module.extract_domain.cache_info().hits == 1
+
     def test_bare_domain_no_scheme(self, main_module):
         # urlparse with no scheme: netloc is empty, falls back to path split
         result = main_module.extract_domain("reddit.com/r/test")
         assert result == "reddit.com"
 
 
-# ── domain_to_conditional helper ──────────────────────────────────────────────
+# ── DOMAIN_STATE lookup ───────────────────────────────────────────────────────
 
 
-class TestDomainToConditional:
+class TestDomainState:
     def test_exact_match_bare_domain(self, main_module):
         # "reddit.com" is in FAKE_CONFIG conditional list
-        result = main_module.domain_to_conditional("reddit.com")
-        assert result == "reddit.com"
+        assert main_module.DOMAIN_STATE["reddit.com"] == ("conditional", "reddit.com")
 
     def test_exact_match_www_domain(self, main_module):
         # "www.reddit.com" is in FAKE_CONFIG conditional list
-        result = main_module.domain_to_conditional("www.reddit.com")
-        assert result == "www.reddit.com"
+        assert main_module.DOMAIN_STATE["www.reddit.com"] == ("conditional", "www.reddit.com")
 
     def test_www_prefix_lookup(self, main_module):
         # youtube.com is in conditional but www.youtube.com is not;
         # requesting "www.youtube.com" should find "youtube.com" as a fallback
-        result = main_module.domain_to_conditional("www.youtube.com")
-        assert result == "youtube.com"
+        assert main_module.DOMAIN_STATE["www.youtube.com"] == ("conditional", "youtube.com")
+
+    def test_always_blocked_domain_and_www_variant(self, main_module):
+        assert main_module.DOMAIN_STATE["twitter.com"] == ("always_blocked", "twitter.com")
+        assert main_module.DOMAIN_STATE["www.twitter.com"] == ("always_blocked", "twitter.com")
 
     def test_unknown_domain_returns_none(self, main_module):
-        result = main_module.domain_to_conditional("facebook.com")
-        assert result is None
+        assert main_module.DOMAIN_STATE.get("facebook.com") is None
 
     def test_unknown_www_domain_returns_none(self, main_module):
-        result = main_module.domain_to_conditional("www.facebook.com")
-        assert result is None
+        assert main_module.DOMAIN_STATE.get("www.facebook.com") is None
+
+    def test_conditional_wins_over_always_blocked(self, main_module):
+        state = main_module._build_domain_state(["youtube.com"], ["www.youtube.com"])
+        assert state["youtube.com"] == ("conditional", "youtube.com")
+        assert state["www.youtube.com"] == ("conditional", "youtube.com")
 
 
 # ── /request-access ───────────────────────────────────────────────────────────
@@ -144,7 +165,7 @@ class TestDomainToConditional:
 
 class TestRequestAccess:
     def test_force_blocked_device_denied_without_llm(self, main_module, client):
-        main_module.force_blocked_devices.add("192.168.1.100")
+        main_module.force_blocked_devices = frozenset({"192.168.1.100"})
         resp = client.post("/request-access", json=access_request())
         data = resp.json()
         assert resp.status_code == 200
@@ -168,37 +189,36 @@ class TestRequestAccess:
         assert data["approved"] is False
         assert "permanently blocked" in data["message"].lower()
 
-    def test_always_blocked_lstrip_bug(self, main_module, client):
-        """Documents the lstrip("www.") bug in main.py lines 163 and 221.
-
-        twitter.com is in always_blocked. www.twitter.com SHOULD also be caught
-        by the `domain.lstrip("www.")` check. However, `lstrip("www.")` strips
-        individual characters from the set {'w', '.'}, not the literal prefix.
-
-        For "www.twitter.com":
-          lstrip("www.") strips 'w','w','w','.' then ALSO strips 't' (not in set)... wait:
-          actually lstrip strips 'w' and '.' chars: wwwtwitter.com — 'w','w','w','.' all stripped,
-          then 't' is NOT in the char set {'w','.'} so stripping stops.
-          Result: "twitter.com" — which happens to be correct for this specific case.
-
-        The bug manifests with domains like "www.woot.com" where 'w','o','o','t' would be
-        partially stripped. This test specifically checks www.twitter.com behavior to document
-        what the code actually does vs. what it should do.
-        """
+    def test_www_always_blocked_domain_denied(self, client):
+        # The www variant of an always-blocked entry is blocked too
         resp = client.post(
             "/request-access",
             json=access_request(url="https://www.twitter.com/home"),
         )
         data = resp.json()
-        # www.twitter.com is not in the conditional list, so domain_to_conditional returns None
-        # Then the always_blocked check runs: domain.lstrip("www.") == "twitter.com"
-        # which is in always_blocked — so the check HAPPENS to work for this domain
         assert resp.status_code == 200
         assert data["approved"] is False
-        # The message could be either "permanently blocked" or "not in managed blocklist"
-        # depending on whether the lstrip check correctly identifies it
-        # Document actual behavior:
-        assert data["message"]  # some message is set
+        assert "permanently blocked" in data["message"].lower()
+
+    def test_non_www_prefix_not_stripped(self, client):
+        # lstrip("www.") would have reduced "w.twitter.com" to "twitter.com"
+        resp = client.post(
+            "/request-access",
+            json=access_request(url="https://w.twitter.com/home"),
+        )
+        data = resp.json()
+        assert data["approved"] is False
+        assert "not in the managed blocklist" in data["message"].lower()
+
+    def test_denied_helper_fills_defaults(self, main_module):
+        resp = main_module._denied("No.", "reddit.com")
+        assert resp.model_dump() == {
+            "approved": False,
+            "scope": None,
+            "duration_minutes": None,
+            "message": "No.",
+            "domain": "reddit.com",
+        }
 
     def test_llm_deny_returns_approved_false(self, main_module, client):
         main_module.llm.evaluate_request.return_value = LLMDecision(
@@ -259,22 +279,36 @@ class TestRequestAccess:
         assert call_kwargs["room"] == "living_room"
 
     def test_llm_called_with_request_count_from_db(self, main_module, client):
-        """request_count_today comes from db.get_today_count."""
-        main_module.db.get_today_count.return_value = 7
+        """request_count_today comes from db.get_device_context."""
+        main_module.db.get_device_context.return_value = (7, [])
         client.post("/request-access", json=access_request())
         call_kwargs = main_module.llm.evaluate_request.call_args.kwargs
         assert call_kwargs["request_count_today"] == 7
 
     def test_llm_called_with_recent_requests_from_db(self, main_module, client):
-        """recent_requests comes from db.get_recent_requests."""
+        """recent_requests comes from db.get_device_context."""
         fake_history = [
             {"url": "https://youtube.com", "reason": "music", "approved": True, "timestamp": "2024-02-06T20:00:00"}
         ]
-        main_module.db.get_recent_requests.return_value = fake_history
+        main_module.db.get_device_context.return_value = (1, fake_history)
         client.post("/request-access", json=access_request())
         call_kwargs = main_module.llm.evaluate_request.call_args.kwargs
         assert call_kwargs["recent_requests"] == fake_history
 
+    def test_context_fetches_run_concurrently(self, main_module, client):
+        """The HA room lookup does not hold up the DB queries."""
+        async def room_seen_alongside_db(device_ip):
+            for _ in range(10):
+                if main_module.db.get_device_context.await_count:
+                    return "office"
+                await asyncio.sleep(0)
+            return None
+
+        main_module.ha_client.get_device_room.side_effect = room_seen_alongside_db
+        client.post("/request-access", json=access_request())
+        call_kwargs = main_module.llm.evaluate_request.call_args.kwargs
+        assert call_kwargs["room"] == "office"
+
     def test_llm_approve_calls_unblock_domain(self, main_module, client):
         main_module.llm.evaluate_request.return_value = LLMDecision(
             approved=True, scope="/*", duration_minutes=15, message="ok"
@@ -341,6 +375,16 @@ class TestRequestAccess:
         log_call = main_module.db.log_request.call_args
         assert log_call.kwargs["device_ip"] == "192.168.1.100"
 
+    def test_force_block_during_llm_call_denies_approval(self, main_module, client):
+        async def approve_after_force_block(**kwargs):
+            main_module.force_blocked_devices = frozenset({"192.168.1.100"})
+            return LLMDecision(approved=True, scope="/*", duration_minutes=15, message="OK")
+
+        main_module.llm.evaluate_request.side_effect = approve_after_force_block
+        data = client.post("/request-access", json=access_request()).json()
+        assert data["approved"] is False
+        main_module.blocklist.unblock_domain.assert_not_called()
+
 
 # ── /force-block and /force-unblock ───────────────────────────────────────────
 
@@ -368,12 +412,12 @@ class TestForceBlock:
             reason="work",
             duration_minutes=15,
         )
-        main_module.blocklist.active_unblocks["reddit.com"] = unblock
+        main_module.blocklist._track_unblock("reddit.com", unblock)
 
         client.post("/force-block", json={"device_ip": "192.168.1.100"})
 
-        # reblock_domain should have been called for reddit.com
-        main_module.blocklist.reblock_domain.assert_called_with("reddit.com")
+        # reddit.com should have been re-blocked in one batch
+        main_module.blocklist.reblock_domains.assert_called_once_with(["reddit.com"])
 
     def test_force_block_only_revokes_matching_device(self, main_module, client):
         """Active unblocks for OTHER devices should not be revoked."""
@@ -386,24 +430,23 @@ class TestForceBlock:
             reason="music",
             duration_minutes=30,
         )
-        main_module.blocklist.active_unblocks["youtube.com"] = other_unblock
+        main_module.blocklist._track_unblock("youtube.com", other_unblock)
 
         client.post("/force-block", json={"device_ip": "192.168.1.100"})
 
-        # reblock_domain should NOT have been called for youtube.com
-        for call in main_module.blocklist.reblock_domain.call_args_list:
-            assert call.args[0] != "youtube.com"
+        # youtube.com should NOT have been re-blocked
+        main_module.blocklist.reblock_domains.assert_called_once_with([])
 
 
 class TestForceUnblock:
     def test_removes_device_from_force_blocked(self, main_module, client):
-        main_module.force_blocked_devices.add("192.168.1.100")
+        main_module.force_blocked_devices = frozenset({"192.168.1.100"})
         resp = client.post("/force-unblock", json={"device_ip": "192.168.1.100"})
         assert resp.status_code == 200
         assert "192.168.1.100" not in main_module.force_blocked_devices
 
     def test_unblocked_device_can_request_access(self, main_module, client):
-        main_module.force_blocked_devices.add("192.168.1.100")
+        main_module.force_blocked_devices = frozenset({"192.168.1.100"})
         client.post("/force-unblock", json={"device_ip": "192.168.1.100"})
 
         main_module.llm.evaluate_request.return_value = LLMDecision(
@@ -431,11 +474,46 @@ class TestStatus:
         assert data["force_blocked_devices"] == []
 
     def test_force_blocked_device_appears_in_status(self, main_module, client):
-        main_module.force_blocked_devices.add("192.168.1.100")
+        main_module.force_blocked_devices = frozenset({"192.168.1.100"})
         resp = client.get("/status")
         data = resp.json()
         assert "192.168.1.100" in data["force_blocked_devices"]
 
+    def test_active_unblock_serialized(self, main_module, client):
+        from blocklist import ActiveUnblock
+        unblock = ActiveUnblock(
+            domain="reddit.com",
+            device_ip="192.168.1.100",
+            device_name="test-laptop",
+            scope="/r/python/*",
+            reason="work",
+            duration_minutes=15,
+        )
+        main_module.blocklist.get_active_unblocks.return_value = [unblock]
+        entry = client.get("/status").json()["active_unblocks"][0]
+        assert entry["domain"] == "reddit.com"
+        assert entry["scope"] == "/r/python/*"
+        assert entry["expires_at"] == unblock.expires_at.isoformat()
+
+    def test_repeat_poll_served_from_cache(self, main_module, client):
+        client.get("/status")
+        resp = client.get("/status")
+        assert resp.json()["active_unblocks"] == []
+        main_module.blocklist.get_active_unblocks.assert_called_once()
+
+    def test_blocklist_change_rebuilds_status(self, main_module, client):
+        client.get("/status")
+        main_module.blocklist.revision += 1
+        client.get("/status")
+        assert main_module.blocklist.get_active_unblocks.call_count == 2
+
+    def test_force_block_invalidates_status(self, client):
+        client.get("/status")
+        client.post("/force-block", json={"device_ip": "192.168.1.100"})
+        assert client.get("/status").json()["force_blocked_devices"] == ["192.168.1.100"]
+        client.post("/force-unblock", json={"device_ip": "192.168.1.100"})
+        assert client.get("/status").json()["force_blocked_devices"] == []
+
 
 # ── /revoke ────────────────────────────────────────────────────────────────────
 
@@ -465,6 +543,17 @@ class TestHistory:
         client.get("/history")
         main_module.db.get_today_history.assert_called_once()
 
+    def test_rows_serialized_as_history_entries(self, main_module, client):
+        main_module.db.get_today_history.return_value = [{
+            "id": 1, "timestamp": "2024-02-06T20:00:00", "device_ip": "192.168.1.100",
+            "device_name": None, "url": "https://reddit.com", "domain": "reddit.com",
+            "reason": "work", "room": None, "approved": 1, "scope": "/*",
+            "duration_minutes": 15, "llm_message": "ok", "request_number_today": 1,
+        }]
+        entry = client.get("/history").json()["requests"][0]
+        assert entry["approved"] is True
+        assert entry["timestamp"] == "2024-02-06T20:00:00"
+
 
 # ── /debug/prompt vs /request-access duplicate name bug ──────────────────────
 